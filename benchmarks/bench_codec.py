@@ -0,0 +1,58 @@
+"""Benchmark of storage codecs on realistic story histories
+
+Usage: python benchmarks/bench_codec.py
+"""
+
+from random import Random
+from timeit import timeit
+
+import jsonpickle as jsp
+
+from troubadour.codec import codecs, decode_value, encode_value
+from troubadour.interfaces import Cmd, DisplayCmd, ImageCmd, NewPageCmd
+from troubadour.rich_text import RichText
+
+WORDS = """sed neque quam porttitor vitae mattis quis efficitur sit amet enim nullam
+orci ut lacus pharetra tristique suspendisse posuere id elit at maecenas erat est
+euismod nec nulla eu arcu eget sapien tortor lacinia laoreet mauris nam vel""".split()
+
+
+def make_history(pages: int) -> list[Cmd]:
+    # pseudo-random text so that compression ratios are not overestimated
+    random = Random(0)
+    history: list[Cmd] = []
+    for page in range(pages):
+        paragraph = " ".join(random.choices(WORDS, k=80))
+        history.insert(0, NewPageCmd())
+        history.insert(
+            0,
+            DisplayCmd(
+                RichText(paragraph + " Are we {}? You have **{}** coins.").format(
+                    RichText("doomed").classes("red").tooltip("Je suis une tooltip"),
+                    page,
+                )
+            ),
+        )
+        history.insert(0, DisplayCmd(RichText(f"You chose option {page % 3}.")))
+        if page % 10 == 0:
+            history.insert(0, ImageCmd("https://picsum.photos/800/200", "image"))
+    return history
+
+
+def main() -> None:
+    for pages in [10, 100, 1000]:
+        data = jsp.encode(make_history(pages))
+        print(f"{pages} pages, {len(data)} characters of json")
+        for codec in codecs.values():
+            stored = encode_value(data, codec)
+            encode = timeit(lambda: encode_value(data, codec), number=5) / 5
+            decode = timeit(lambda: decode_value(stored), number=5) / 5
+            print(
+                f"  {codec.name:>10}: {len(stored):>9} chars, "
+                f"ratio {len(data) / len(stored):6.1f}, "
+                f"encode {encode * 1e3:8.2f} ms, decode {decode * 1e3:8.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Benchmark of RichText builder chains
+
+Usage: python benchmarks/bench_rich_text.py
+"""
+
+from timeit import timeit
+
+from troubadour.rich_text import RichText, render_cache
+
+
+def deep_chain(depth: int) -> RichText:
+    text = RichText("**start**")
+    for i in range(depth):
+        text = RichText(f"{i} {{}}").format(text).classes("red").tooltip("tooltip")
+    return text
+
+
+def wide_chain(width: int) -> RichText:
+    text = RichText("{}" * width)
+    for i in range(width):
+        text = text.format(RichText(str(i)).classes("blue"))
+    return text
+
+
+def main() -> None:
+    maxsize = render_cache.maxsize
+    render_cache.maxsize = 0  # measure rendering itself, not the cache
+    try:
+        for name, builder, sizes in [
+            ("deep", deep_chain, [10, 50, 100, 200]),
+            ("wide", wide_chain, [10, 100, 1000, 2000]),
+        ]:
+            for size in sizes:
+                number = max(1, 1000 // size)
+                build = timeit(lambda: builder(size), number=number) / number
+                text = builder(size)
+                render = timeit(lambda: text.render(), number=number) / number
+                print(
+                    f"{name:>5} {size:>5}: build {build * 1e3:8.3f} ms, "
+                    f"render {render * 1e3:8.3f} ms"
+                )
+    finally:
+        render_cache.maxsize = maxsize
+
+
+if __name__ == "__main__":
+    main()
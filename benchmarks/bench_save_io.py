@@ -0,0 +1,68 @@
+"""Benchmark of the python side of save export and import on large archives
+
+Usage: python benchmarks/bench_save_io.py
+"""
+
+import tracemalloc
+from time import perf_counter
+from typing import Any, Callable
+
+import jsonpickle as jsp
+
+from bench_codec import make_history
+from troubadour.codec import Utf8Assembler
+
+CHUNK_SIZE = 1 << 20
+
+
+def export_js_source(content: str) -> str:
+    # previous export: json escaped and pasted into JS source for run_js
+    escaped = content.encode("unicode_escape").decode("utf-8")
+    return f"const blob = new Blob([`{escaped}`], {{type: 'text/json'}});"
+
+
+def export_bytes(content: str) -> bytes:
+    return content.encode("utf-8")
+
+
+def import_whole(data: bytes) -> Any:
+    return jsp.decode(data.decode("utf-8"))
+
+
+def import_chunks(data: bytes) -> Any:
+    text = Utf8Assembler()
+    for start in range(0, len(data), CHUNK_SIZE):
+        text.feed(data[start : start + CHUNK_SIZE])
+    return jsp.decode(text.result())
+
+
+def measure(func: Callable[[Any], Any], arg: Any) -> tuple[float, int]:
+    tracemalloc.start()
+    start = perf_counter()
+    func(arg)
+    duration = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak
+
+
+def main() -> None:
+    for nb_saves in [1, 10, 50]:
+        archive = jsp.encode([make_history(200) for _ in range(nb_saves)])
+        data = archive.encode("utf-8")
+        print(f"{nb_saves} saves, {len(data) / 1e6:.1f} MB archive")
+        cases: list[tuple[str, Callable[[Any], Any], Any]] = [
+            ("export js source", export_js_source, archive),
+            ("export bytes", export_bytes, archive),
+            ("import whole", import_whole, data),
+            ("import chunks", import_chunks, data),
+        ]
+        for name, func, arg in cases:
+            duration, peak = measure(func, arg)
+            print(
+                f"  {name:>16}: {duration * 1e3:9.2f} ms, " f"peak {peak / 1e6:8.2f} MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""Benchmarks of the page turn hot paths, run on the headless render backend
+
+Usage: python benchmarks/bench_suite.py [--output FILE] [--quick]
+
+Results are written as JSON (bench_results.json by default), so that runs of
+different versions can be compared.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime
+from statistics import median
+from timeit import repeat
+from typing import Any, Callable
+
+import jsonpickle as jsp
+
+from bench_codec import make_history
+import troubadour as tbd
+import troubadour.headless_render as psr
+import troubadour.html_impl as html_impl
+from troubadour.html_impl import (
+    GameSave,
+    GameSaves,
+    GameState,
+    InfoPanel,
+    SaveIndex,
+    Story,
+)
+from troubadour.rich_text import RichText, render_cache
+from troubadour.storage import MemoryBackend
+
+
+@dataclass
+class BenchGame(tbd.Game):
+    story: Story = field(default_factory=Story)
+    info: InfoPanel = field(default_factory=lambda: InfoPanel(RichText("")))
+    turn: int = 0
+
+    def start(self) -> tbd.Inputs:
+        return self.next()
+
+    def next(self) -> tbd.Inputs:
+        self.turn += 1
+        self.story.newpage()
+        self.story.display(
+            RichText("Turn {}, you have **{}** coins, you are {}.").format(
+                self.turn, self.turn * 3, RichText("doomed").tooltip("sorry")
+            )
+        )
+        self.info.set_text(
+            RichText("str: **{}**\n\nagi: **{}**").format(
+                RichText(str(self.turn % 7)).classes("red").tooltip("Strength"), 2
+            )
+        )
+        return [tbd.Button(f"Option {i}", "next") for i in range(3)]
+
+
+def make_game(history_length: int) -> BenchGame:
+    game = BenchGame()
+    game.story.history = make_history(history_length // 3 + 1)[:history_length]
+    return game
+
+
+def new_page() -> None:
+    psr.reset()
+    html_impl.story_view = html_impl.StoryView()
+    html_impl.state_journal = html_impl.StateJournal()
+
+
+def deep_text(depth: int) -> RichText:
+    text = RichText("**start**")
+    for i in range(depth):
+        text = RichText(f"{i} {{}}").format(text).classes("red").tooltip("tooltip")
+    return text
+
+
+def tooltip_text(count: int) -> RichText:
+    text = RichText("{} " * count)
+    return text.format(*(RichText(f"w{i}").tooltip(f"*tt {i}*") for i in range(count)))
+
+
+def markdown_text(paragraphs: int) -> RichText:
+    paragraph = "Some *markdown* with a [link](https://example.com) and **bold**."
+    return RichText(
+        "\n\n".join(f"## Part {i}\n\n{paragraph}" for i in range(paragraphs))
+    )
+
+
+def bench_render(results: dict[str, Any], quick: bool) -> None:
+    maxsize = render_cache.maxsize
+    render_cache.maxsize = 0  # measure rendering itself, not the cache
+    try:
+        for name, text in [
+            ("deep-50", deep_text(50)),
+            ("tooltips-200", tooltip_text(200)),
+            ("markdown-100", markdown_text(100)),
+        ]:
+            results[f"render/{name}"] = measure(text.render, 20 if quick else 100)
+    finally:
+        render_cache.maxsize = maxsize
+
+
+def bench_state(results: dict[str, Any], quick: bool) -> None:
+    for length in [100, 1000] if quick else [100, 1000, 10000]:
+        state = GameState(make_game(length), [tbd.Button("Go", "next")])
+        encoded = jsp.encode(state)
+        number = max(1, 1000 // length)
+        results[f"state/encode-{length}"] = measure(lambda: jsp.encode(state), number)
+        results[f"state/decode-{length}"] = measure(lambda: jsp.decode(encoded), number)
+
+
+def bench_run_page(results: dict[str, Any], quick: bool) -> None:
+    for length in [100, 1000]:
+        new_page()
+        game = make_game(length)
+        html_impl.run_page(game, "start")
+        results[f"run_page/history-{length}"] = measure(
+            lambda: html_impl.run_page(game, "next"), 10 if quick else 50
+        )
+
+
+def bench_load_cache_data(results: dict[str, Any], quick: bool) -> None:
+    for length in [100, 1000]:
+        new_page()
+        html_impl.run_page(make_game(length), "start")
+        results[f"load_cache_data/stored-{length}"] = measure(
+            lambda: html_impl.load_cache_data(None), 5 if quick else 20
+        )
+
+        def replay() -> None:
+            del psr.local_storage["story-cache"]
+            html_impl.load_cache_data(None)
+
+        results[f"load_cache_data/replay-{length}"] = measure(
+            replay, 5 if quick else 20
+        )
+
+
+def bench_merge(results: dict[str, Any], quick: bool) -> None:
+    for count in [10, 50]:
+        # half of the imported saves are duplicates of stored ones
+        states = [GameState(make_game(100 + i), []) for i in range(count)]
+        imported_states = list(enumerate(states))[count // 2 :] + [
+            (count + i, GameState(make_game(10 + i), [])) for i in range(count // 2)
+        ]
+        date = datetime(2023, 1, 1)
+        new_page()
+        backend = MemoryBackend()
+        asyncio.run(psr.use_storage(backend))
+        index = SaveIndex()
+        for i, state in enumerate(states):
+            index.add(GameSave(i, "", state, date))
+        stored = dict(backend.values)
+
+        def merge() -> None:
+            # as importing a save file, on the stored saves
+            backend.values = dict(stored)
+            imported = [GameSave(i, "", s, date) for i, s in imported_states]
+            SaveIndex(list(index.saves)).merge(GameSaves(imported))
+
+        results[f"merge/saves-{count}"] = measure(merge, 1 if quick else 3)
+
+
+def measure(func: Callable[[], Any], number: int) -> dict[str, Any]:
+    times = [t / number for t in repeat(func, number=number, repeat=3)]
+    return dict(number=number, min_ms=min(times) * 1e3, median_ms=median(times) * 1e3)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--quick", action="store_true", help="fewer, smaller runs")
+    args = parser.parse_args()
+
+    results: dict[str, Any] = {}
+    for bench in [
+        bench_render,
+        bench_state,
+        bench_run_page,
+        bench_load_cache_data,
+        bench_merge,
+    ]:
+        bench(results, args.quick)
+    for name, result in results.items():
+        print(f"{name:>32}: {result['median_ms']:10.3f} ms")
+
+    with open(args.output, "w") as file:
+        json.dump(
+            dict(
+                version=tbd.__version__,
+                python=sys.version.split()[0],
+                platform=platform.platform(),
+                date=datetime.now().isoformat(timespec="seconds"),
+                results=results,
+            ),
+            file,
+            indent=2,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -15,9 +15,9 @@ class MyGame(tbd.Game):
         # self.porthole.set_url("https://picsum.photos/300/350")
         # self.info.set_title("Informazion")
         self.info.set_text(
-            RichText("str: **{}**\n\nagi: **2**\n\nint: **3**").format(
-                RichText("4").classes("red").tooltip("Strength")
-            )
+            RichText("str: **{}**\n\nagi: **2**\n\nint: **3**")
+            .compile()
+            .format(RichText("4").classes("red").tooltip("Strength"))
         )
 
         self.story.display(
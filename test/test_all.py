@@ -1,3 +1,12 @@
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime
+import json
+import os
+import subprocess
+import sys
+
+import jsonpickle as jsp
 import pytest
 from selenium import webdriver
 from selenium.webdriver import FirefoxOptions
@@ -5,7 +14,22 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.wait import WebDriverWait
 
-from troubadour.rich_text import RichText
+import troubadour as tbd
+import troubadour.headless_render as psr
+import troubadour.html_impl as html_impl
+import troubadour.interfaces as itf
+from troubadour.codec import Utf8Assembler, codecs, decode_value, encode_value
+from troubadour.html_impl import (
+    GameSave,
+    GameState,
+    InfoPanel,
+    SaveIndex,
+    Story,
+    run_game,
+)
+from troubadour.rich_text import RichText, compile_template, render_cache
+from troubadour.storage import LocalStorage, MemoryBackend, migrate
+from troubadour.timing import timings
 
 
 @pytest.mark.web
@@ -60,3 +84,454 @@ def test_richtext() -> None:
         ),
         {"troubadour_tooltip_0": "<p>explanation</p>\n"},
     )
+
+
+def test_render_cache() -> None:
+    render_cache.clear()
+    text = RichText("Hello {}").format(RichText("you").tooltip("**me**"))
+
+    html, tooltips = text.render()
+    assert render_cache.stats()["misses"] == 1
+    (id,) = tooltips
+
+    # same content, new object: hit with fresh tooltip ids
+    html2, tooltips2 = (
+        RichText("Hello {}").format(RichText("you").tooltip("**me**")).render()
+    )
+    assert render_cache.stats()["hits"] == 1
+    (id2,) = tooltips2
+    assert id2 != id
+    assert html2 == html.replace(id, id2)
+    assert tooltips2[id2] == tooltips[id]
+
+    # bounded size
+    render_cache.clear()
+    maxsize = render_cache.maxsize
+    render_cache.maxsize = 2
+    try:
+        for i in range(4):
+            RichText(f"text {i}").render()
+        assert render_cache.stats()["size"] == 2
+        assert render_cache.stats()["evictions"] == 2
+    finally:
+        render_cache.maxsize = maxsize
+
+
+def test_richtext_immutable() -> None:
+    inner = RichText("world").classes("red")
+    a = RichText("Hello {}").format(inner)
+    b = a.classes("big").tooltip("tt")
+
+    # builders do not modify the original and share subtrees
+    assert a._classes == () and a._tooltip is None
+    assert b._args[0] is inner
+    with pytest.raises(AttributeError):
+        a._text = "Bye"  # type: ignore
+
+    # rendering does not modify the text
+    b.render()
+    assert b._classes == ("big",)
+
+    # value semantics
+    assert a == RichText("Hello {}").format(RichText("world").classes("red"))
+    assert hash(a) == hash(
+        RichText("Hello {}").format(RichText("world").classes("red"))
+    )
+
+    # jsonpickle round trip, including data saved before RichText used slots
+    assert jsp.decode(jsp.encode(b)) == b
+    old = (
+        '{"py/object": "troubadour.rich_text.RichText", "_text": "Hello {}", '
+        '"_classes": [], "_tooltip": null, "_args": [{"py/object": '
+        '"troubadour.rich_text.RichText", "_text": "world", "_classes": ["red"], '
+        '"_tooltip": null, "_args": [], "_kwargs": {}}], "_kwargs": {}}'
+    )
+    assert jsp.decode(old) == a
+
+
+def test_richtext_compile() -> None:
+    template = RichText("# Stats\n\nstr: **{}**, agi: *{agi}*").compile()
+    for value in ["4", "<5> & co"]:
+        text = template.format(RichText(value).classes("red"), agi=2)
+        regular = RichText(text._text).format(*text._args, **text._kwargs)
+        assert text.render() == regular.render()
+    assert compile_template.cache_info().currsize >= 1
+
+    # arguments are escaped text, not markdown
+    assert RichText("a {}").compile().format("*b*").render() == (
+        "<p>a *b*</p>\n",
+        {},
+    )
+
+    # unsupported templates fall back to regular rendering
+    assert RichText("{:>3}").compile().format(1).render() == ("<p>1</p>\n", {})
+
+    # arguments are text too when a compiled text falls back to regular rendering
+    arg = '*b* <i>"q"</i>'
+    compiled, _ = RichText("a {}").compile().format(arg).render()
+    assert compiled == "<p>a *b* &lt;i&gt;&quot;q&quot;&lt;/i&gt;</p>\n"
+    assert RichText("a {!s}").compile().format(arg).render() == (compiled, {})
+    for fallback in [
+        RichText("a {}").compile().format(arg).classes("x"),
+        RichText("a {}").compile().format(arg).tooltip("tooltip"),
+    ]:
+        assert compiled[3:-5] in fallback.render()[0]
+
+    # placeholders inside tags are not spliced as text
+    assert compile_template("[link]({})") is None
+    html, _ = RichText("[link]({})").compile().format('a" onclick="x').render()
+    assert 'onclick="' not in html
+
+
+def test_codecs() -> None:
+    data = jsp.encode(
+        [RichText("Hello {}, ça va? 😀").format(RichText("world").classes("red"))] * 50
+    )
+    for codec in codecs.values():
+        stored = encode_value(data, codec)
+        assert decode_value(stored) == data
+        assert not any(0xD800 <= ord(char) <= 0xDFFF for char in stored)
+    assert len(encode_value(data, codecs["zlib-utf16"])) < len(data) / 4
+
+    # values stored before codecs existed are read as is
+    assert decode_value(data) == data
+
+
+def test_utf8_assembler() -> None:
+    text = "Ça va? 😀 " * 100
+    data = text.encode("utf-8")
+    assembler = Utf8Assembler()
+    for start in range(0, len(data), 7):  # chunks split multi-byte characters
+        assembler.feed(data[start : start + 7])
+    assert assembler.result() == text
+
+
+def test_storage() -> None:
+    old = MemoryBackend({"save-1": jsp.encode(RichText("old")), "other": "kept"})
+    storage = LocalStorage(MemoryBackend())
+    asyncio.run(migrate(old, storage.backend))
+    assert old.keys() == ["other"]  # keys of other pages of the origin
+
+    # values stored before codecs existed are still readable after migration
+    assert storage(RichText)["save-1"] == RichText("old")
+
+    size = storage.store("text", RichText("new"))
+    assert size == len(storage.backend.get("text") or "")
+    assert storage(RichText)["text"] == RichText("new")
+    del storage["text"]
+    assert storage["text"] is None
+    assert storage.backend.keys() == ["save-1"]
+
+
+DIGEST_SCRIPT = """
+from dataclasses import dataclass, field
+
+from troubadour.html_impl import GameState, Story, state_digest
+
+
+@dataclass
+class Game:
+    story: Story = field(default_factory=Story)
+    items: set[str] = field(default_factory=lambda: {"sword", "shield", "map"})
+    places: frozenset[str] = frozenset({"north", "south", "east", "west"})
+
+
+print(state_digest(GameState(Game(), [])))
+"""
+
+
+def test_state_digest_stable() -> None:
+    # set iteration order changes with the hash seed of each interpreter
+    digests = {
+        subprocess.run(
+            [sys.executable, "-c", DIGEST_SCRIPT],
+            capture_output=True,
+            text=True,
+            env={**os.environ, "PYTHONHASHSEED": str(seed)},
+        ).stdout
+        for seed in range(8)
+    }
+    assert len(digests) == 1 and "" not in digests
+
+
+@dataclass
+class HeadlessGame(tbd.Game):
+    story: Story = field(default_factory=Story)
+    info: InfoPanel = field(default_factory=lambda: InfoPanel(RichText("")))
+
+    def start(self) -> tbd.Inputs:
+        self.info.set_text(RichText("hp: {}").format(RichText("3").tooltip("health")))
+        self.story.display(RichText("You are {}").format(RichText("doomed")))
+        return [tbd.Button("Go", "go")]
+
+    def go(self) -> tbd.Inputs:
+        self.story.newpage()
+        self.story.display(RichText("Where {}?").format(RichText("to").tooltip("?")))
+        return [tbd.Button("Back", "start"), tbd.TextInput("Send", "send", "home")]
+
+    def send(self, msg: str) -> tbd.Inputs:
+        self.story.display(f"Going {msg}")
+        return [tbd.Button("Go", "go")]
+
+
+def new_page(max_pages: int = html_impl.StoryView.max_pages) -> None:
+    # a fresh page and the module state of html_impl, as after a page load
+    psr.reset()
+    html_impl.story_view = html_impl.StoryView(max_pages=max_pages)
+    html_impl.state_journal = html_impl.StateJournal()
+    html_impl.interface_actions.clear()
+    html_impl.page_turns = 0
+    html_impl.running_game = None
+    html_impl.pending_state = None
+    html_impl.write_scheduled = False
+
+
+def click_button(text: str) -> None:
+    (button,) = [
+        node
+        for node in psr.document["story-interface"].find_all("button")
+        if node.text().strip() == text
+    ]
+    psr.dispatch(button, "click")
+
+
+def test_headless_game() -> None:
+    new_page()
+    storage = MemoryBackend()
+    run_game(HeadlessGame(), storage)
+
+    assert "You are doomed" in psr.get_text("story")
+    with pytest.raises(KeyError):  # only the elements of the page template
+        psr.get_text("stroy")
+    assert "hp: 3" in psr.get_text("info-content")
+    assert "<p>health</p>\n" in psr.tooltips.values()
+    click_button("Go")
+    click_button("Send")
+    assert "Going home" in psr.get_text("story")
+    click_button("Go")
+    (input,) = psr.document["story-interface"].find_all("input")
+    assert input.id is not None
+    psr.set_value(input.id, "north")
+    click_button("Send")
+    assert "Going north" in psr.get_text("story")
+
+    # save
+    psr.set_value("save-input", "my save")
+    psr.click("save-modal-save")
+    index = psr.local_storage(SaveIndex)["saves-index"]
+    assert index is not None and [save.name for save in index.saves] == ["my save"]
+    assert "my save" in psr.get_text("saves-table")
+
+    # export on demand, then import the exported saves as duplicates of existing
+    # ones and as new ones
+    assert psr.downloaded == []
+    psr.click("load-modal-download")
+    ((filename, content),) = psr.downloaded
+    assert filename.startswith("saves-") and b"my save" in content
+    psr.upload_file("load-modal-import", content)
+    assert psr.get_text("saves-table").count("my save") == 1
+    exported = jsp.decode(content)
+    exported.saves[0].save.game.story.display("Elsewhere")
+    psr.upload_file("load-modal-import", jsp.encode(exported))
+    assert psr.get_text("saves-table").count("my save") == 2
+
+    # resume in a new page with the same storage
+    new_page()
+    run_game(HeadlessGame(), storage)
+    assert psr.has_class("resume-modal", "is-active")
+    psr.click("resume-modal-load")
+    assert "Going north" in psr.get_text("story")
+    assert "my save" in psr.get_text("saves-table")
+
+
+@dataclass
+class SilentGame(HeadlessGame):
+    def start(self) -> tbd.Inputs:
+        return [tbd.Button("Go", "go")]
+
+
+def test_silent_start() -> None:
+    # the first page does not write to the story
+    new_page()
+    run_game(SilentGame(), MemoryBackend())
+    state = html_impl.get_state()
+    assert state is not None and state.game.story.history == []
+    assert psr.local_storage["story-cache"] is not None
+
+
+def test_live_objects() -> None:
+    new_page(max_pages=3)
+    run_game(HeadlessGame(), MemoryBackend())
+
+    # listeners and tooltips of replaced interfaces, info panels, saves tables
+    # and story pages are released
+    def save() -> None:
+        psr.set_value("save-input", "save")
+        psr.click("save-modal-save")
+
+    def turn() -> None:
+        click_button("Go")
+        click_button("Back")
+        save()
+        (link,) = [
+            node
+            for node in psr.document["saves-table"].descendants()
+            if node.attrs.get("data-troubadour-save") == "delete:1"
+        ]
+        psr.dispatch(link, "click")
+
+    save()
+    for _ in range(3):
+        turn()
+    live = psr.live_objects()
+    for _ in range(10):
+        turn()
+    assert psr.live_objects() == live
+    assert psr.get_text("saves-table").count("Delete") == 1
+    listeners = sum(
+        len(funcs)
+        for node in psr.document.body.descendants()
+        for funcs in node.listeners.values()
+    )
+    assert listeners == live["listeners"] + 1  # the unscoped scroll listener
+    assert len(psr.tooltips) == live["tooltips"]
+
+    # the scroll listener survives the story being rewritten
+    html_impl.story_view.show_pages()
+    first_page = html_impl.story_view.first_page
+    psr.scroll_top("story")
+    assert html_impl.story_view.first_page == first_page - 1
+
+
+@dataclass
+class Stats(HeadlessGame):
+    hp: float = 1
+    alive: bool | int = True
+
+
+def test_state_digest_numbers() -> None:
+    # saves equal under == are duplicates, whatever the types of their numbers
+    new_page()
+    index = SaveIndex()
+    now = datetime.now()
+    for game in [Stats(), Stats(hp=1.0, alive=1), Stats(hp=1.5)]:
+        save = GameSave(0, "save", GameState(game, []), now)
+        index.merge(html_impl.GameSaves([save]))
+    assert GameState(Stats(), []) == GameState(Stats(hp=1.0, alive=1), [])
+    assert len(index.saves) == 2
+
+
+@dataclass
+class AsyncGame(HeadlessGame):
+    pending: list[tuple[bool, str, int]] = field(default_factory=list)
+
+    async def go(self) -> tbd.Inputs:  # type: ignore[override]
+        self.story.display("Searching")
+        await asyncio.sleep(0)
+        # the story is already shown and the interface ignores clicks
+        self.pending.append(
+            (
+                psr.has_class("story-interface", "troubadour-pending"),
+                psr.get_text("story"),
+                len(html_impl.interface_actions),
+            )
+        )
+        await asyncio.sleep(0)
+        self.story.display("Found a path")
+        return [tbd.Button("Back", "start")]
+
+
+def test_async_game() -> None:
+    new_page()
+    game = AsyncGame()
+    run_game(game, MemoryBackend())
+    click_button("Go")
+
+    ((pending, story, actions),) = game.pending
+    assert pending and "Searching" in story and "Found" not in story
+    assert actions == 0
+
+    assert not psr.has_class("story-interface", "troubadour-pending")
+    assert "Found a path" in psr.get_text("story")
+    click_button("Back")
+    state = html_impl.get_state()
+    assert state is not None and state.interface == [tbd.Button("Go", "go")]
+    assert itf.DisplayCmd(RichText("Found a path")) in state.game.story.history
+
+
+@dataclass
+class FailingAsyncGame(HeadlessGame):
+    async def go(self) -> tbd.Inputs:  # type: ignore[override]
+        await asyncio.sleep(0)
+        raise RuntimeError("lost")
+
+
+@dataclass
+class RestartedAsyncGame(HeadlessGame):
+    async def go(self) -> tbd.Inputs:  # type: ignore[override]
+        self.story.display("Searching")
+        await asyncio.sleep(0)
+        psr.click("restart-modal-restart")  # while the game method runs
+        await asyncio.sleep(0)
+        self.story.display("Still searching")
+        self.story.newpage()
+        self.story.image("map.png", "map")
+        return [tbd.Button("Back", "start")]
+
+
+def test_async_game_interrupted() -> None:
+    # the interface comes back after an error
+    new_page()
+    run_game(FailingAsyncGame(), MemoryBackend())
+    with pytest.raises(RuntimeError, match="lost"):
+        click_button("Go")
+    assert not psr.has_class("story-interface", "troubadour-pending")
+    assert list(html_impl.interface_actions) == ["0"]
+
+    # the restarted game is not replaced by the page of the game method
+    new_page()
+    run_game(RestartedAsyncGame(), MemoryBackend())
+    click_button("Go")
+    assert psr.get_text("story-interface") == "Go"
+    state = html_impl.get_state()
+    assert state is not None and state.interface == [tbd.Button("Go", "go")]
+    assert "Searching" not in psr.get_text("story")
+    assert "Still searching" not in psr.get_text("story")
+    assert "map.png" not in psr.get_html("story")
+
+
+def test_timings() -> None:
+    new_page()
+    timings.enable(maxlen=3)
+    try:
+        run_game(HeadlessGame(), MemoryBackend())
+        for _ in range(2):
+            click_button("Go")
+            click_button("Back")
+    finally:
+        timings.disable()
+    click_button("Go")  # not recorded
+
+    # ring buffer with the last page turns
+    assert [t.name for t in timings.records] == [
+        "run_page:start",
+        "run_page:go",
+        "run_page:start",
+    ]
+    assert set(timings.records[-1].phases) >= {"game", "render_info", "state_write"}
+    assert "run_page:go (1 records)" in timings.summary()
+    assert json.loads(timings.export())[0]["name"] == "run_page:start"
+    timings.clear()
+
+
+def test_lazy_imports() -> None:
+    # in a fresh interpreter, the other tests import them directly
+    code = (
+        "import sys; import troubadour.html_impl; from troubadour.lazy import mistune; "
+        "print('mistune' in sys.modules, 'jsonpickle' in sys.modules); "
+        "mistune.html; print('mistune' in sys.modules)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True
+    )
+    assert result.stdout.split() == ["False", "False", "True"]
@@ -1,6 +1,8 @@
 from troubadour.interfaces import Button, Game, Input, TextInput, Inputs
 from troubadour.rich_text import RichText
 
+__version__ = "0.1"
+
 __all__ = [
     "Button",
     "Game",
@@ -0,0 +1,117 @@
+import base64
+import zlib
+from codecs import getincrementaldecoder
+from typing import Protocol
+
+# stored values start with HEADER followed by the codec name and a colon, values
+# without it are plain jsonpickle output written before codecs existed
+HEADER = "~tbd1:"
+
+
+class Codec(Protocol):
+    name: str
+
+    def encode(self, data: str) -> str:
+        pass
+
+    def decode(self, data: str) -> str:
+        pass
+
+
+class RawCodec:
+    name = "raw"
+
+    def encode(self, data: str) -> str:
+        return data
+
+    def decode(self, data: str) -> str:
+        return data
+
+
+class ZlibBase64Codec:
+    name = "zlib"
+
+    def __init__(self, level: int = 6) -> None:
+        self.level = level
+
+    def encode(self, data: str) -> str:
+        compressed = zlib.compress(data.encode("utf-8"), self.level)
+        return base64.b64encode(compressed).decode("ascii")
+
+    def decode(self, data: str) -> str:
+        return zlib.decompress(base64.b64decode(data)).decode("utf-8")
+
+
+class ZlibUtf16Codec:
+    # browsers count localStorage quota in UTF-16 code units, so compressed
+    # bytes are packed 15 bits per code unit, shifted to avoid control
+    # characters and staying below the surrogate range
+    name = "zlib-utf16"
+    offset = 0x20
+
+    def __init__(self, level: int = 6) -> None:
+        self.level = level
+
+    def encode(self, data: str) -> str:
+        compressed = zlib.compress(data.encode("utf-8"), self.level)
+        padding = -len(compressed) % 15
+        compressed += bytes(padding)
+        chars = [chr(self.offset + padding)]
+        for start in range(0, len(compressed), 15):
+            block = int.from_bytes(compressed[start : start + 15], "big")
+            for shift in range(105, -1, -15):
+                chars.append(chr(self.offset + ((block >> shift) & 0x7FFF)))
+        return "".join(chars)
+
+    def decode(self, data: str) -> str:
+        padding = ord(data[0]) - self.offset
+        compressed = bytearray()
+        for start in range(1, len(data), 8):
+            block = 0
+            for char in data[start : start + 8]:
+                block = (block << 15) | (ord(char) - self.offset)
+            compressed += block.to_bytes(15, "big")
+        if padding:
+            del compressed[-padding:]
+        return zlib.decompress(compressed).decode("utf-8")
+
+
+codecs: dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec) -> None:
+    codecs[codec.name] = codec
+
+
+register_codec(RawCodec())
+register_codec(ZlibBase64Codec())
+register_codec(ZlibUtf16Codec())
+
+
+def encode_value(data: str, codec: Codec) -> str:
+    if isinstance(codec, RawCodec):
+        return data  # readable by versions without codecs
+    return f"{HEADER}{codec.name}:{codec.encode(data)}"
+
+
+def decode_value(value: str) -> str:
+    if not value.startswith(HEADER):
+        return value
+    name, _, data = value[len(HEADER) :].partition(":")
+    if name not in codecs:
+        raise ValueError(f"Unknown storage codec {name}")
+    return codecs[name].decode(data)
+
+
+class Utf8Assembler:
+    # decodes text received in chunks that can split multi-byte characters
+    def __init__(self) -> None:
+        self.decoder = getincrementaldecoder("utf-8")()
+        self.parts: list[str] = []
+
+    def feed(self, chunk: bytes) -> None:
+        self.parts.append(self.decoder.decode(chunk))
+
+    def result(self) -> str:
+        self.parts.append(self.decoder.decode(b"", final=True))
+        return "".join(self.parts)
@@ -0,0 +1,521 @@
+import asyncio
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from html import escape
+from html.parser import HTMLParser
+from pathlib import Path
+import re
+from string import Template
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Iterator,
+    Optional,
+    Type,
+    TypeVar,
+    overload,
+)
+
+from troubadour.lazy import jsonpickle as jsp
+from troubadour.storage import (  # noqa: F401
+    LocalStorage,
+    MemoryBackend,
+    StorageBackend,
+    TypedLocalStorage,
+    migrate,
+)
+
+# Same functions as troubadour.pyscript_render, on an in-memory DOM, so that
+# games can run and be clicked through in CPython (tests, benchmarks, builds).
+
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link"}
+VOID_TAGS |= {"meta", "source", "track", "wbr"}
+
+TEMPLATES = Path(__file__).parent.parent / "templates"
+PAGE_PARTS = re.compile(r"<head>(.*)</head>.*<body[^>]*>(.*)</body>", re.DOTALL)
+
+
+@dataclass(eq=False)
+class Node:
+    tag: str
+    attrs: dict[str, Optional[str]] = field(default_factory=dict)
+    children: list["Node | str"] = field(default_factory=list, repr=False)
+    parent: Optional["Node"] = field(default=None, repr=False)
+    listeners: dict[str, list[Callable[[Any], Any]]] = field(
+        default_factory=dict, repr=False
+    )
+    value: str = ""
+    files: list[bytes] = field(default_factory=list, repr=False)
+
+    @property
+    def id(self) -> Optional[str]:
+        return self.attrs.get("id")
+
+    @property
+    def classes(self) -> list[str]:
+        return (self.attrs.get("class") or "").split()
+
+    def descendants(self) -> Iterator["Node"]:
+        for child in self.children:
+            if isinstance(child, Node):
+                yield child
+                yield from child.descendants()
+
+    def is_connected(self, document: "Document") -> bool:
+        node = self
+        while node.parent is not None:
+            node = node.parent
+        return node is document.body or node is document.head
+
+    def find_all(self, cls: str) -> list["Node"]:
+        return [node for node in self.descendants() if cls in node.classes]
+
+    def text(self) -> str:
+        return "".join(
+            child if isinstance(child, str) else child.text() for child in self.children
+        )
+
+    def inner_html(self) -> str:
+        return "".join(
+            escape(child, quote=False) if isinstance(child, str) else child.html()
+            for child in self.children
+        )
+
+    def html(self) -> str:
+        attrs = "".join(
+            f" {name}" if value is None else f' {name}="{escape(value)}"'
+            for name, value in self.attrs.items()
+        )
+        if self.tag in VOID_TAGS:
+            return f"<{self.tag}{attrs}>"
+        return f"<{self.tag}{attrs}>{self.inner_html()}</{self.tag}>"
+
+
+@dataclass
+class Event:
+    type: str
+    target: Node
+    currentTarget: Optional[Node] = None
+
+
+class FragmentParser(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__()
+        self.root = Node("template")
+        self.current = self.root
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, Optional[str]]]) -> None:
+        node = Node(tag, dict(attrs), parent=self.current)
+        self.current.children.append(node)
+        if tag not in VOID_TAGS:
+            self.current = node
+
+    def handle_startendtag(
+        self, tag: str, attrs: list[tuple[str, Optional[str]]]
+    ) -> None:
+        self.current.children.append(Node(tag, dict(attrs), parent=self.current))
+
+    def handle_endtag(self, tag: str) -> None:
+        node: Optional[Node] = self.current
+        while node is not None and node.tag != tag:
+            node = node.parent
+        if node is not None and node.parent is not None:  # ignores stray end tags
+            self.current = node.parent
+
+    def handle_data(self, data: str) -> None:
+        self.current.children.append(data)
+
+
+def parse(html: str) -> list[Node | str]:
+    parser = FragmentParser()
+    parser.feed(html)
+    parser.close()
+    return parser.root.children
+
+
+class Document:
+    def __init__(self) -> None:
+        self.head = Node("head")
+        self.body = Node("body", {"id": "body"})
+        self.elements: dict[str, Node] = {"body": self.body}
+
+    def __getitem__(self, id: str) -> Node:
+        return self.elements[id]
+
+    def register(self, node: Node) -> None:
+        for element in [node, *node.descendants()]:
+            if element.id is not None:
+                self.elements[element.id] = element
+
+    def unregister(self, node: Node) -> None:
+        for element in [node, *node.descendants()]:
+            if element.id is not None and self.elements.get(element.id) is element:
+                del self.elements[element.id]
+
+    def insert(
+        self, parent: Node, nodes: list[Node | str], start: bool = False
+    ) -> None:
+        for node in nodes:
+            if isinstance(node, Node):
+                node.parent = parent
+                self.register(node)
+        if start:
+            parent.children[:0] = nodes
+        else:
+            parent.children.extend(nodes)
+
+    def remove_children(self, parent: Node) -> None:
+        for child in parent.children:
+            if isinstance(child, Node):
+                self.unregister(child)
+                child.parent = None
+        parent.children = []
+
+    def remove(self, node: Node) -> None:
+        self.unregister(node)
+        if node.parent is not None:
+            node.parent.children.remove(node)
+            node.parent = None
+
+
+@dataclass
+class Scope:
+    # listeners and tooltips owned by an element, see pyscript_render.listen
+    element: Node
+    listeners: list[tuple[Node, str, Callable[[Any], Any]]] = field(
+        default_factory=list
+    )
+    tooltips: list[str] = field(default_factory=list)
+
+
+document = Document()
+tooltips: dict[str, str] = {}
+downloaded: list[tuple[str, bytes]] = []  # (file name, content)
+scopes: dict[str, Scope] = {}
+local_storage = LocalStorage(MemoryBackend())
+
+
+@lru_cache
+def page_template(main_container: Optional[str]) -> tuple[str, str]:
+    # head and body of the generated index.html, without vendored assets
+    if main_container is None:
+        main_container = (TEMPLATES / "main.html").read_text()
+    index = Template((TEMPLATES / "index.html").read_text())
+    page = index.substitute(defaultdict(str, main_container=main_container))
+    match = PAGE_PARTS.search(page)
+    assert match is not None
+    return match[1], match[2]
+
+
+def reset(main_container: Optional[str] = None) -> None:
+    # starts a new page from the index template, with the content of main.html
+    # or the given html in the main container
+    global document, local_storage
+    document = Document()
+    head, body = page_template(main_container)
+    document.insert(document.head, parse(head))
+    document.insert(document.body, parse(body))
+    tooltips.clear()
+    downloaded.clear()
+    scopes.clear()
+    local_storage = LocalStorage(MemoryBackend())
+
+
+reset()
+
+
+def scope(owner: str) -> Scope:
+    element = document[owner]
+    if owner not in scopes or scopes[owner].element is not element:
+        release_scope(owner)  # the id now belongs to another element
+        scopes[owner] = Scope(element)
+    return scopes[owner]
+
+
+def release_scope(owner: str) -> None:
+    released = scopes.pop(owner, None)
+    if released is None:
+        return
+    for node, type, func in released.listeners:
+        node.listeners[type].remove(func)
+    for id in released.tooltips:
+        tooltips.pop(id, None)
+
+
+def release_detached() -> None:
+    for owner, owner_scope in list(scopes.items()):
+        if not owner_scope.element.is_connected(document):
+            release_scope(owner)
+
+
+def live_objects() -> dict[str, int]:
+    return {
+        "scopes": len(scopes),
+        "listeners": sum(len(s.listeners) for s in scopes.values()),
+        "tooltips": sum(len(s.tooltips) for s in scopes.values()),
+    }
+
+
+# tasks started by run_async() in an event loop
+tasks: set[asyncio.Task] = set()
+
+
+def run_async(coroutine: Coroutine[Any, Any, None]) -> None:
+    # outside of an event loop, coroutines run to completion right away, with
+    # the tasks they start
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(run_all(coroutine))
+        return
+    task = asyncio.ensure_future(coroutine)
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+
+
+async def run_all(coroutine: Coroutine[Any, Any, None]) -> None:
+    await coroutine
+    while tasks:
+        await asyncio.gather(*tasks)
+
+
+def when_idle(func: Callable[[], None]) -> None:
+    # there is nothing else to do between events
+    func()
+
+
+def closest(node: Node, tag: str) -> Optional[Node]:
+    current: Optional[Node] = node
+    while current is not None and current.tag != tag:
+        current = current.parent
+    return current
+
+
+def dispatch(node: Node, type: str) -> None:
+    # events bubble up to the ancestors of the target, as in the browser
+    event = Event(type, node)
+    current: Optional[Node] = node
+    while current is not None:
+        event.currentTarget = current
+        for listener in list(current.listeners.get(type, [])):
+            result = listener(event)
+            if asyncio.iscoroutine(result):
+                run_async(result)
+        current = current.parent
+
+    # submit buttons submit their form
+    button = closest(node, "button")
+    if type == "click" and button is not None:
+        form = closest(button, "form")
+        if form is not None and button.attrs.get("type", "submit") == "submit":
+            dispatch(form, "submit")
+
+
+def listen(
+    id: str, type: str, func: Callable[[Any], Any], owner: Optional[str] = None
+) -> None:
+    document[id].listeners.setdefault(type, []).append(func)
+    scope(owner or id).listeners.append((document[id], type, func))
+
+
+def delegate(
+    id: str,
+    type: str,
+    attribute: str,
+    func: Callable[[str], None],
+    owner: str = "body",
+) -> None:
+    container = document[id]
+
+    def listener(event: Event) -> None:
+        node: Optional[Node] = event.target
+        while node is not None and attribute not in node.attrs:
+            node = None if node is container else node.parent
+        if node is not None:
+            func(node.attrs[attribute] or "")
+
+    listen(id, type, listener, owner)
+
+
+@contextmanager
+def batch() -> Iterator[None]:
+    # operations are applied right away, there is no FFI to save
+    yield
+
+
+def flush() -> None:
+    pass
+
+
+def onclick(id: str, func: Callable[[Any], None], owner: Optional[str] = None) -> None:
+    listen(id, "click", func, owner)
+
+
+def onload(id: str, func: Callable[[Any], None], owner: Optional[str] = None) -> None:
+    listen(id, "load", func, owner)
+
+
+def insert_end(id: str, html: str) -> None:
+    document.insert(document[id], parse(html))
+
+
+def insert_start_keep_scroll(id: str, html: str) -> None:
+    document.insert(document[id], parse(html), start=True)
+
+
+def remove(id: str) -> None:
+    document.remove(document[id])
+    release_detached()
+
+
+def set_html(id: str, html: str) -> None:
+    document.remove_children(document[id])
+    release_scope(id)
+    release_detached()
+    document.insert(document[id], parse(html))
+
+
+def clear(id: str) -> None:
+    set_html(id, "")
+
+
+def click(id: str) -> None:
+    dispatch(document[id], "click")
+
+
+def set_src(id: str, value: str) -> None:
+    document[id].attrs["src"] = value
+
+
+def set_alt(id: str, value: str) -> None:
+    document[id].attrs["alt"] = value
+
+
+def get_value(id: str) -> str:
+    return document[id].value
+
+
+def set_value(id: str, value: str) -> None:
+    document[id].value = value
+
+
+def get_html(id: str) -> str:
+    return document[id].inner_html()
+
+
+def get_text(id: str) -> str:
+    return document[id].text()
+
+
+def has_class(id: str, cls: str) -> bool:
+    return cls in document[id].classes
+
+
+def add_tooltip(id: str, text: str, owner: Optional[str] = None) -> None:
+    add_tooltips({id: text}, owner)
+
+
+def add_tooltips(new_tooltips: dict[str, str], owner: Optional[str] = None) -> None:
+    for id, text in new_tooltips.items():
+        if id not in tooltips:
+            scope(owner or id).tooltips.append(id)
+        tooltips[id] = text
+
+
+def add_class(id: str, cls: str) -> None:
+    if cls not in document[id].classes:
+        document[id].attrs["class"] = " ".join(document[id].classes + [cls])
+
+
+def remove_class(id: str, cls: str) -> None:
+    classes = [c for c in document[id].classes if c != cls]
+    document[id].attrs["class"] = " ".join(classes)
+
+
+def activate_modal(id: str) -> None:
+    add_class(id, "is-active")
+
+
+def deactivate_modal(id: str) -> None:
+    remove_class(id, "is-active")
+
+
+def disable(id: str) -> None:
+    document[id].attrs["disabled"] = "disabled"
+
+
+def enable(id: str) -> None:
+    document[id].attrs.pop("disabled", None)
+
+
+def set_display(id: str, display: str) -> None:
+    document[id].attrs["style"] = f"display: {display}"
+
+
+def scroll_to_bottom(id: str) -> None:
+    pass
+
+
+def on_scroll_top(id: str, func: Callable[[Any], None]) -> None:
+    # not scoped, the listener lives as long as the element
+    document[id].listeners.setdefault("scrolltop", []).append(func)
+
+
+def scroll_top(id: str) -> None:
+    dispatch(document[id], "scrolltop")
+
+
+T = TypeVar("T")
+
+
+async def use_storage(backend: Optional[StorageBackend] = None) -> None:
+    await local_storage.use(backend if backend is not None else MemoryBackend())
+
+
+def download(content: str | bytes, filename: str) -> None:
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    downloaded.append((filename, content))
+
+
+def on_download(id: str, func: Callable[[], tuple[str | bytes, str]]) -> None:
+    listen(id, "click", lambda _: download(*func()))
+
+
+def upload_file(id: str, content: str | bytes) -> None:
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    document[id].files = [content]
+    dispatch(document[id], "change")
+
+
+@overload
+def on_file_upload(id: str, callback: Callable[[str], None], cls: None = None) -> None:
+    pass
+
+
+@overload
+def on_file_upload(id: str, callback: Callable[[T], None], cls: Type[T]) -> None:
+    pass
+
+
+def on_file_upload(
+    id: str,
+    callback: Callable[[str], None] | Callable[[T], None],
+    cls: Optional[Type[T]] = None,
+) -> None:
+    def event_handler(event: Event, cb: Callable = callback) -> None:
+        for f in event.target.files:
+            raw = f.decode("utf-8")
+            if cls is None:
+                cb(raw)
+            else:
+                decoded = jsp.decode(raw)
+                assert isinstance(decoded, cls)
+                cb(decoded)
+        event.target.files = []
+
+    listen(id, "change", event_handler)
@@ -1,15 +1,29 @@
 from copy import deepcopy
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Any, Callable, Optional
+from hashlib import sha256
+import json
+from typing import Any, Callable, Coroutine, Optional
 from enum import Enum
+from functools import partial
+import inspect
+import sys
 
-import jsonpickle as jsp
-
-from troubadour.id import get_id
+from troubadour import __version__
+from troubadour.id import get_id, peek_id, reserve_ids
 import troubadour.interfaces as itf
-import troubadour.pyscript_render as psr
+from troubadour.lazy import jsonpickle as jsp
+
 from troubadour.rich_text import RichText, make_rich_text
+from troubadour.timing import timings
+
+# a variable rather than a sys.platform check in the condition, so that mypy
+# checks both branches
+PYODIDE = sys.platform == "emscripten"
+if PYODIDE:
+    import troubadour.pyscript_render as psr
+else:  # tests, benchmarks and prerendering in CPython
+    import troubadour.headless_render as psr  # type: ignore[no-redef]
 
 
 @dataclass
@@ -64,58 +78,185 @@ class GameState:
     interface: list[itf.Input]
 
 
+@dataclass
+class JournalEntry:
+    base: int  # length of the story history the entry applies to
+    cmds: list[itf.Cmd]  # new story commands, most recent first
+    state: GameState  # with an empty story history
+
+
+@dataclass
+class StateJournal:
+    # page turns only store the new story commands and the rest of the game
+    # state, a full snapshot is written every snapshot_interval page turns
+    snapshot_interval: int = 50
+    game: Optional[itf.Game] = field(default=None, repr=False)
+    length: int = 0
+    saved_history: int = 0
+
+    def write(self, game: itf.Game, interface: list[itf.Input]) -> None:
+        history = game.story.history
+        new_game = game is not self.game or len(history) < self.saved_history
+        if new_game or self.length >= self.snapshot_interval:
+            self.snapshot(GameState(game, interface))
+            return
+
+        new_cmds = history[: len(history) - self.saved_history]
+        entry = JournalEntry(self.saved_history, new_cmds, GameState(game, interface))
+        game.story.history = []  # not copying the game to encode it without history
+        try:
+            psr.local_storage[f"state-journal-{self.length}"] = entry
+        finally:
+            game.story.history = history
+        self.length += 1
+        self.saved_history = len(history)
+        psr.local_storage["state-journal-length"] = self.length
+
+    def snapshot(self, state: GameState) -> None:
+        psr.local_storage["state"] = state
+        psr.local_storage["state-journal-length"] = 0
+        for i in range(self.length):
+            del psr.local_storage[f"state-journal-{i}"]
+        self.attach(state.game)
+        self.length = 0
+
+    def attach(self, game: itf.Game) -> None:
+        self.game = game
+        self.saved_history = len(game.story.history)
+
+    def read(self) -> Optional[GameState]:
+        state = psr.local_storage(GameState)["state"]
+        if state is None:
+            return None
+        self.length = psr.local_storage(int)["state-journal-length"] or 0
+        history = state.game.story.history
+        for i in range(self.length):
+            entry = psr.local_storage(JournalEntry)[f"state-journal-{i}"]
+            if entry is None or entry.base != len(history):
+                break  # left over from before the last snapshot
+            history = entry.cmds + history
+            state = entry.state
+        state.game.story.history = history
+        return state
+
+
+state_journal = StateJournal()
+
+
+def canonical_json(value: Any) -> Any:
+    # sets are encoded in iteration order, which changes with the hash seed, and
+    # equal numbers of different types are encoded differently
+    def sorted_items(items: list[Any]) -> list[Any]:
+        canonical = map(canonical_json, items)
+        return sorted(canonical, key=lambda item: json.dumps(item, sort_keys=True))
+
+    match value:
+        case {"py/set": list(items)}:
+            return {"py/set": sorted_items(items)}
+        case {
+            "py/reduce": [
+                {"py/type": "builtins.frozenset"},
+                {"py/tuple": [list(items)]},
+            ]
+        }:
+            frozenset_type = {"py/type": "builtins.frozenset"}
+            return {"py/reduce": [frozenset_type, {"py/tuple": [sorted_items(items)]}]}
+        case dict():
+            return {key: canonical_json(item) for key, item in value.items()}
+        case list():
+            return [canonical_json(item) for item in value]
+        # numbers that compare equal have the same encoding
+        case bool():
+            return int(value)
+        case float() if value.is_integer():
+            return int(value)
+        case _:
+            return value
+
+
+def state_digest(state: GameState) -> str:
+    # equal states give equal digests: no references between objects, sorted
+    # keys and sorted sets
+    encoded = canonical_json(json.loads(jsp.encode(state, make_refs=False)))
+    canonical = json.dumps(encoded, sort_keys=True, separators=(",", ":"))
+    return sha256(canonical.encode("utf-8")).hexdigest()
+
+
 @dataclass
 class GameSave:
     nb: int
     name: str
     save: GameState
     date: datetime
+    digest: Optional[str] = field(default=None, compare=False)
+
+    def get_digest(self) -> str:
+        if self.digest is None:  # saves made before digests existed
+            self.digest = state_digest(self.save)
+        return self.digest
 
 
 @dataclass
 class GameSaves:
+    # all saves in a single object, used for save files
     saves: list[GameSave] = field(default_factory=list)
 
+
+@dataclass
+class SaveInfo:
+    nb: int
+    name: str
+    date: datetime
+    size: int
+    digest: Optional[str] = None
+
+
+@dataclass
+class SaveIndex:
+    # each save is stored under its own key, the index only describes them
+    saves: list[SaveInfo] = field(default_factory=list)
+
     def init(self) -> None:
         def load_saves(saves: GameSaves) -> None:
-            old_saves = psr.local_storage(GameSaves)["saves"]
-            assert old_saves is not None
-            old_saves.merge(saves)
-            old_saves.render()
-            psr.local_storage["saves"] = old_saves
+            index = get_saves()
+            count = len(index.saves)
+            index.merge(saves)
+            index.render_new(count)
+            psr.local_storage["saves-index"] = index
+
+        def export_saves() -> tuple[bytes, str]:
+            # built when the player downloads the saves, every save is decoded
+            return (
+                str(jsp.encode(get_saves().export())).encode("utf-8"),
+                f"saves{datetime.today().strftime('-%Y%m%d-%H%M')}.json",
+            )
 
         psr.on_file_upload("load-modal-import", load_saves, GameSaves)
+        psr.on_download("load-modal-download", export_saves)
 
-    def render(self) -> None:
-        psr.clear("saves-table")
-        for save in self.saves:
-            psr.insert_end(
-                "saves-table",
-                f"""
-<tr>
+    @staticmethod
+    def row_id(nb: int) -> str:
+        return f"troubadour-save-{nb}"
+
+    def render_row(self, save: SaveInfo) -> str:
+        return f"""
+<tr id="{self.row_id(save.nb)}">
     <th>{save.nb}</th>
     <th>{save.name}</th>
     <th>{save.date.strftime("%Y-%m-%d %H:%M")}</th>
     <th>
-        <a id="troubadour-load-{save.nb}" href="javascript:void(0);">Load</a> -
-        <a id="troubadour-rmsave-{save.nb}" href="javascript:void(0);">Delete</a>
+        <a data-troubadour-save="load:{save.nb}" href="javascript:void(0);">Load</a> -
+        <a data-troubadour-save="delete:{save.nb}" href="javascript:void(0);">Delete</a>
     </th>
-</tr>""",
-            )
-            psr.onclick(
-                f"troubadour-rmsave-{save.nb}",
-                lambda _, id=save.nb: delete_save(id),  # type:ignore
-            )
-            psr.onclick(
-                f"troubadour-load-{save.nb}",
-                lambda _, id=save.nb: load_save(id),  # type:ignore
-            )
+</tr>"""
 
-        psr.file_download_button(
-            "load-modal-download",
-            str(jsp.encode(self)),
-            f"saves{datetime.today().strftime('-%Y%m%d-%H%M')}.json",
-        )
+    def render(self) -> None:
+        psr.set_html("saves-table", "".join(map(self.render_row, self.saves)))
+
+    def render_new(self, count: int) -> None:
+        # rows of the saves added after the first count ones
+        for save in self.saves[count:]:
+            psr.insert_end("saves-table", self.render_row(save))
 
     def get_next_id(self) -> int:
         if self.saves == []:
@@ -123,13 +264,51 @@ class GameSaves:
         else:
             return max(save.nb for save in self.saves) + 1
 
-    def merge(self, other: "GameSaves") -> None:
+    def add(self, save: GameSave) -> None:
+        size = psr.local_storage.store(f"save-{save.nb}", save.save)
+        info = SaveInfo(save.nb, save.name, save.date, size, save.get_digest())
+        self.saves.append(info)
+
+    def remove(self, nb: int) -> None:
+        del psr.local_storage[f"save-{nb}"]
+        self.saves = [save for save in self.saves if save.nb != nb]
+
+    def load(self, nb: int) -> GameState:
+        state = psr.local_storage(GameState)[f"save-{nb}"]
+        assert state is not None
+        return state
+
+    def load_save(self, info: SaveInfo) -> GameSave:
+        return GameSave(info.nb, info.name, self.load(info.nb), info.date, info.digest)
+
+    def get_digest(self, info: SaveInfo) -> str:
+        if info.digest is None:  # saves made before digests existed
+            info.digest = self.load_save(info).get_digest()
+        return info.digest
+
+    def export(self) -> GameSaves:
+        return GameSaves([self.load_save(info) for info in self.saves])
+
+    def merge(self, other: GameSaves) -> None:
+        # digests only narrow down the saves to compare, equality decides, so
+        # only the stored saves with the same digest as an imported one are decoded
         next_id = self.get_next_id()
+        infos_by_digest: dict[str, list[SaveInfo]] = {}
+        for info in self.saves:
+            infos_by_digest.setdefault(self.get_digest(info), []).append(info)
+        known_saves: dict[int, GameSave] = {}  # decoded or added during the merge
         for save in other.saves:
-            if save not in self.saves:
+            save.digest = state_digest(save.save)  # not trusted from save files
+            same_digest = infos_by_digest.setdefault(save.get_digest(), [])
+            for info in same_digest:
+                if info.nb not in known_saves:
+                    known_saves[info.nb] = self.load_save(info)
+            if save not in [known_saves[info.nb] for info in same_digest]:
                 save.nb = next_id
                 next_id += 1
-                self.saves.append(save)
+                self.add(save)
+                known_saves[save.nb] = save
+                same_digest.append(self.saves[-1])
 
 
 def render_porthole(porthole: Optional[itf.ImagePanel]) -> None:
@@ -146,70 +325,267 @@ def render_info(info: Optional[itf.InfoPanel]) -> None:
         psr.set_display("info", "block")
         text, tooltips = info.get_text().render()
         psr.set_html("info-content", text)
+        psr.add_tooltips(tooltips, owner="info-content")
 
         title = info.get_title()
         if title is not None:
             title_text, title_tooltips = title.render()
             psr.set_html("info-title", title_text)
-            tooltips |= title_tooltips
+            psr.add_tooltips(title_tooltips, owner="info-title")
             psr.set_display("info-header", "flex")
         else:
+            psr.clear("info-title")  # releases the tooltips of the previous title
             psr.set_display("info-header", "none")
-
-        for id, text in tooltips.items():
-            psr.add_tooltip(id, text)
     else:
         psr.set_display("info", "none")
 
 
+def render_divider() -> str:
+    t = datetime.today().strftime("%Y-%m-%d %H:%M:%S")
+    return f'<div class="divider">{t}</div>'
+
+
+def render_image(url: str, alt: str, id: int) -> str:
+    return f"""<div class="card">
+                <div class="card-image">
+                    <figure class="image">
+                    <img id="troubadour_image_{id}" src="{url}" alt="{alt}">
+                    </figure>
+                </div>
+            </div>"""
+
+
+def render_cmd(cmd: itf.Cmd) -> tuple[str, dict[str, str]]:
+    match cmd:
+        case itf.DisplayCmd(text):
+            return text.render()
+        case itf.NewPageCmd():
+            return render_divider(), {}
+        case itf.ImageCmd(url, alt):
+            return render_image(url, alt, get_id()), {}
+        case _:
+            raise NotImplementedError()
+
+
+def split_pages(history: list[itf.Cmd]) -> list[list[itf.Cmd]]:
+    # history is most recent first, pages are in chronological order and each
+    # page except the first one starts with its NewPageCmd
+    pages: list[list[itf.Cmd]] = [[]]
+    for cmd in reversed(history):
+        if isinstance(cmd, itf.NewPageCmd):
+            pages.append([])
+        pages[-1].append(cmd)
+    return pages
+
+
+@dataclass
+class StoryPage:
+    html: str = ""
+    tooltips: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class StoryCache:
+    version: str
+    history_length: int
+    first_page: int
+    last_page: int
+    next_id: int
+
+
+@dataclass
+class StoryView:
+    # only the last max_pages pages of the story are kept in the DOM, older
+    # pages are rebuilt from the story history when the player scrolls up
+    max_pages: int = 20
+    story: Optional[itf.Story] = field(default=None, repr=False)
+    first_page: int = 0
+    last_page: int = 0
+
+    # rendered pages currently in the DOM, stored next to the game state so
+    # that resuming a game does not need to render the story again
+    pages: dict[int, StoryPage] = field(default_factory=dict, repr=False)
+    unsaved_pages: set[int] = field(default_factory=set)
+    removed_pages: set[int] = field(default_factory=set)
+
+    @staticmethod
+    def page_id(page: int) -> str:
+        return f"troubadour_page_{page}"
+
+    def page_html(self, page: int) -> str:
+        return (
+            f'<div id="{self.page_id(page)}" class="troubadour-page">'
+            f"{self.pages[page].html}</div>"
+        )
+
+    def render_page(self, page: int, cmds: list[itf.Cmd]) -> None:
+        story_page = StoryPage()
+        for cmd in cmds:
+            html, tooltips = render_cmd(cmd)
+            story_page.html += f"<div>{html}</div>"
+            story_page.tooltips |= tooltips
+        self.pages[page] = story_page
+        self.unsaved_pages.add(page)
+
+    def show_pages(self) -> None:
+        psr.set_html(
+            "story",
+            "".join(
+                self.page_html(page)
+                for page in range(self.first_page, self.last_page + 1)
+            ),
+        )
+        for page in range(self.first_page, self.last_page + 1):
+            psr.add_tooltips(self.pages[page].tooltips, owner=self.page_id(page))
+        psr.scroll_to_bottom("story")
+
+    def reset(self, story: itf.Story) -> None:
+        self.story = story
+        self.removed_pages |= set(self.pages)
+        self.pages = {}
+        pages = split_pages(story.history)
+        self.last_page = len(pages) - 1
+        self.first_page = max(0, len(pages) - self.max_pages)
+        for page in range(self.first_page, self.last_page + 1):
+            self.render_page(page, pages[page])
+        self.show_pages()
+
+    def restore(self, story: itf.Story) -> bool:
+        cache = psr.local_storage(StoryCache)["story-cache"]
+        if cache is None or cache.version != __version__:
+            return False
+        if cache.history_length != len(story.history):
+            return False  # not written after the last state
+        pages = {}
+        for page in range(cache.first_page, cache.last_page + 1):
+            stored_page = psr.local_storage(StoryPage)[f"story-page-{page}"]
+            if stored_page is None:
+                return False
+            pages[page] = stored_page
+
+        self.story = story
+        self.pages = pages
+        self.first_page, self.last_page = cache.first_page, cache.last_page
+        self.unsaved_pages = set()
+        self.removed_pages = set()
+        reserve_ids(cache.next_id)  # ids used in the stored html
+        self.show_pages()
+        return True
+
+    def save(self) -> None:
+        assert self.story is not None
+        for page in self.unsaved_pages:
+            psr.local_storage[f"story-page-{page}"] = self.pages[page]
+        for page in self.removed_pages - set(self.pages):
+            del psr.local_storage[f"story-page-{page}"]
+        self.unsaved_pages = set()
+        self.removed_pages = set()
+        psr.local_storage["story-cache"] = StoryCache(
+            __version__,
+            len(self.story.history),
+            self.first_page,
+            self.last_page,
+            peek_id(),
+        )
+
+    def attach(self, story: itf.Story) -> None:
+        if story is not self.story:
+            self.reset(story)
+
+    def append(self, html: str, tooltips: dict[str, str]) -> None:
+        self.pages[self.last_page].html += f"<div>{html}</div>"
+        self.pages[self.last_page].tooltips |= tooltips
+        self.unsaved_pages.add(self.last_page)
+        psr.insert_end(self.page_id(self.last_page), f"<div>{html}</div>")
+        psr.add_tooltips(tooltips, owner=self.page_id(self.last_page))
+        psr.scroll_to_bottom("story")
+
+    def new_page(self, html: str) -> None:
+        self.last_page += 1
+        self.render_page(self.last_page, [])
+        psr.insert_end("story", self.page_html(self.last_page))
+        self.append(html, {})
+        while self.last_page - self.first_page >= self.max_pages:
+            psr.remove(self.page_id(self.first_page))
+            del self.pages[self.first_page]
+            self.unsaved_pages.discard(self.first_page)
+            self.removed_pages.add(self.first_page)
+            self.first_page += 1
+
+    def show_earlier_page(self, _: Any = None) -> None:
+        if self.story is None or self.first_page == 0:
+            return
+        self.first_page -= 1
+        pages = split_pages(self.story.history)
+        self.render_page(self.first_page, pages[self.first_page])
+        with psr.batch():
+            psr.insert_start_keep_scroll("story", self.page_html(self.first_page))
+            psr.add_tooltips(
+                self.pages[self.first_page].tooltips,
+                owner=self.page_id(self.first_page),
+            )
+
+
+story_view = StoryView()
+
+
 @dataclass
 class Story(itf.Story):
     history: list[itf.Cmd] = field(default_factory=list)
 
+    # the view is attached to the story of the last page turn, stories of games
+    # replaced meanwhile (restart, load) are not shown
+
     def display(self, text: str | RichText) -> None:
         rich_text = make_rich_text(text)
 
         self.history.insert(0, itf.DisplayCmd(rich_text))
 
-        html_text, tooltips = rich_text.render()
-
-        psr.display_story(html_text)
-
-        for name, tt in tooltips.items():
-            psr.add_tooltip(name, tt)
+        if story_view.story is self:
+            story_view.append(*rich_text.render())
 
     def newpage(self) -> None:
         self.history.insert(0, itf.NewPageCmd())
-        t = datetime.today().strftime("%Y-%m-%d %H:%M:%S")
-        psr.display_story(f'<div class="divider">{t}</div>')
+        if story_view.story is self:
+            story_view.new_page(render_divider())
 
     def image(self, url: str, alt: str) -> None:
         self.history.insert(0, itf.ImageCmd(url, alt))
+        if story_view.story is not self:
+            return
         id = get_id()
-        psr.display_story(
-            f"""<div class="card">
-                <div class="card-image">
-                    <figure class="image">
-                    <img id="troubadour_image_{id}" src="{url}" alt="{alt}">
-                    </figure>
-                </div>
-            </div>"""
+        story_view.append(render_image(url, alt, id), {})
+        psr.onload(
+            f"troubadour_image_{id}",
+            lambda _: psr.scroll_to_bottom("story"),
+            owner=story_view.page_id(story_view.last_page),
         )
-        psr.onload(f"troubadour_image_{id}", lambda _: psr.scroll_to_bottom("story"))
+
+
+# actions of the elements of the story interface, by the value of their
+# data-troubadour-click or data-troubadour-submit attribute, which is the index
+# of the input in the interface
+interface_actions: dict[str, Callable[[], None]] = {}
+
+
+def run_interface_action(key: str) -> None:
+    action = interface_actions.get(key)
+    if action is not None:  # None if the interface changed since the event
+        action()
 
 
 def add_button(
-    text: str, continuation: Callable, tooltip: Optional[str] = None
+    text: str, continuation: Callable[[], None], tooltip: Optional[str] = None
 ) -> None:
-    id = get_id()
+    key = str(len(interface_actions))
+    interface_actions[key] = continuation
     psr.insert_end(
         "story-interface",
         (
             '<button class="button" type="button" '
-            f'id="troubadour_button_{id}">{text}</button>'
+            f'data-troubadour-click="{key}">{text}</button>'
         ),
     )
-    psr.onclick(f"troubadour_button_{id}", continuation)
 
 
 def add_text_input(
@@ -218,49 +594,55 @@ def add_text_input(
     default_value: str = "",
     placeholder_text: str = "",
 ) -> None:
-    id = get_id()
+    key = str(len(interface_actions))
     psr.insert_end(
         "story-interface",
         f"""
-        <div class="field has-addons">
+        <form class="field has-addons" data-troubadour-submit="{key}">
             <div class="control is-flex-grow-1">
-                <input id="troubadour_inputtext_input_{id}"
+                <input id="troubadour_inputtext_input_{key}"
                     class="input" type="text" placeholder="{placeholder_text}">
             </div>
             <div class="control">
-                <a id="troubadour_inputtext_button_{id}" class="button">
-                    {button_text}
-                </a>
+                <button class="button" type="submit">{button_text}</button>
             </div>
-        </div>""",
+        </form>""",
     )
 
-    def callback(_: Any) -> None:
-        value: str = psr.get_value(f"troubadour_inputtext_input_{id}")
+    def callback() -> None:
+        value: str = psr.get_value(f"troubadour_inputtext_input_{key}")
         if value == "":
             value = default_value
         continuation(value)
 
-    psr.onclick(f"troubadour_inputtext_button_{id}", callback)
+    interface_actions[key] = callback
 
 
 def get_state() -> Optional[GameState]:
-    return psr.local_storage(GameState)["state"]
+    write_pending_state()
+    return state_journal.read()
 
 
-def get_saves() -> Optional[GameSaves]:
-    return psr.local_storage(GameSaves)["saves"]
+def get_saves() -> SaveIndex:
+    index = psr.local_storage(SaveIndex)["saves-index"]
+    if index is None:
+        index = SaveIndex()
+        old_saves = psr.local_storage(GameSaves)["saves"]  # before per-save keys
+        if old_saves is not None:
+            for save in old_saves.saves:
+                index.add(save)
+        psr.local_storage["saves-index"] = index
+        del psr.local_storage["saves"]
+    return index
 
 
 def render_interface(game: itf.Game, interface: list[itf.Input]) -> None:
+    # the story interface is cleared before, actions of the previous one go too
+    interface_actions.clear()
     for element in interface:
         match element:
             case itf.Button(text, _method, tooltip):
-                add_button(
-                    text,
-                    lambda _, _method=_method: run_page(game, _method),
-                    tooltip,
-                )
+                add_button(text, partial(run_page, game, _method), tooltip)
             case itf.TextInput(
                 button_text=button_text,
                 method=method,
@@ -277,55 +659,174 @@ def render_interface(game: itf.Game, interface: list[itf.Input]) -> None:
                 raise NotImplementedError()
 
 
+# page turns and game loads so far, an asynchronous game method only shows its
+# page if no other page was shown meanwhile (restart, load)
+page_turns = 0
+
+# game of the asynchronous game method being run, its state is only written
+# once the method returns
+running_game: Optional[itf.Game] = None
+
+
 def run_page(game: itf.Game, method: str, **args: Any) -> None:
-    interface = getattr(game, method)(**args)
-    render_info(game.info)
-    render_porthole(game.porthole)
-    psr.clear("story-interface")
-    render_interface(game, interface)
-    psr.local_storage["state"] = GameState(game, interface)
+    global page_turns
+    page_turns += 1
+    story_view.attach(game.story)
+    handler = getattr(game, method)
+    if inspect.iscoroutinefunction(handler):
+        psr.run_async(run_page_async(game, method, handler(**args)))
+        return
+    with timings.record(f"run_page:{method}"):
+        with psr.batch():
+            with timings.phase("game"):
+                interface = handler(**args)
+            show_page(game, interface)
+        write_state(game, interface)
+
+
+async def run_page_async(
+    game: itf.Game, method: str, coroutine: Coroutine[Any, Any, list[itf.Input]]
+) -> None:
+    # the story is updated as the game displays it, and the interface is
+    # disabled until the game method returns
+    global running_game
+    page_turn = page_turns
+    with timings.record(f"run_page:{method}"):
+        write_pending_state()  # before the game method changes the game
+        running_game = game
+        actions = dict(interface_actions)
+        interface_actions.clear()
+        psr.add_class("story-interface", "troubadour-pending")
+        try:
+            with timings.phase("game"):
+                interface = await coroutine
+        except BaseException:
+            if page_turn == page_turns:  # the previous interface is still shown
+                interface_actions.update(actions)
+            raise
+        finally:
+            if running_game is game:
+                running_game = None
+            if page_turn == page_turns:
+                psr.remove_class("story-interface", "troubadour-pending")
+        if page_turn != page_turns:
+            return
+        with psr.batch():
+            show_page(game, interface)
+        write_state(game, interface)
+
+
+def show_page(game: itf.Game, interface: list[itf.Input]) -> None:
+    with timings.phase("render_info"):
+        render_info(game.info)
+    with timings.phase("render_porthole"):
+        render_porthole(game.porthole)
+    with timings.phase("render_interface"):
+        psr.clear("story-interface")
+        render_interface(game, interface)
+    with timings.phase("flush"):  # DOM operations and tooltips
+        psr.flush()
+
+
+# state of the last page turn, written once the browser is idle, so that page
+# turns in a row only write the last one
+pending_state: Optional[GameState] = None
+write_scheduled = False
+
+
+def write_state(game: itf.Game, interface: list[itf.Input]) -> None:
+    global pending_state, write_scheduled
+    pending_state = GameState(game, interface)
+    if not write_scheduled:
+        write_scheduled = True
+        psr.when_idle(write_when_idle)
+
+
+def write_when_idle() -> None:
+    global write_scheduled
+    write_scheduled = False
+    write_pending_state()
+
+
+def write_pending_state() -> None:
+    global pending_state
+    if pending_state is None or pending_state.game is running_game:
+        return  # already written, or the game is being changed
+    state, pending_state = pending_state, None
+    with timings.record("write_state"):
+        with timings.phase("state_write"):
+            state_journal.write(state.game, state.interface)
+        with timings.phase("story_save"):
+            story_view.save()
 
 
 def save_game() -> None:
     saves = get_saves()
     state = get_state()
     assert isinstance(state, GameState)
-    assert isinstance(saves, GameSaves)
     id = saves.get_next_id()
     name = psr.get_value("save-input")
     time = datetime.today()
-    saves.saves.append(GameSave(id, name, state, time))
-    saves.render()
-    psr.local_storage["saves"] = saves
+    saves.add(GameSave(id, name, state, time))
+    saves.render_new(len(saves.saves) - 1)
+    psr.local_storage["saves-index"] = saves
     psr.remove_class("save-modal", "is-active")
 
 
+# actions of the links of the saves table, by the value of their
+# data-troubadour-save attribute, "<action>:<save number>"
+def run_save_action(key: str) -> None:
+    action, nb = key.split(":")
+    save_actions[action](int(nb))
+
+
 def delete_save(id: int) -> None:
     saves = get_saves()
-    assert isinstance(saves, GameSaves)
-    saves.saves = [save for save in saves.saves if save.nb != id]
-    psr.local_storage["saves"] = saves
-    saves.render()
+    saves.remove(id)
+    psr.local_storage["saves-index"] = saves
+    psr.remove(saves.row_id(id))
 
 
 def load_save(id: int) -> None:
-    saves = get_saves()
-    assert isinstance(saves, GameSaves)
-    save = next(save for save in saves.saves if save.nb == id)
-    psr.local_storage["state"] = save.save
+    write_pending_state()  # before it is replaced by the loaded game
+    state_journal.snapshot(get_saves().load(id))
+    del psr.local_storage["story-cache"]  # belongs to the previous game
     load_cache_data(None)
     psr.remove_class("load-modal", "is-active")
 
 
-def run_game(game: itf.Game) -> None:
+save_actions: dict[str, Callable[[int], None]] = {
+    "load": load_save,
+    "delete": delete_save,
+}
+
+
+def run_game(game: itf.Game, storage: Optional[psr.StorageBackend] = None) -> None:
+    # the storage is loaded asynchronously, the game starts once it is ready
+    async def start() -> None:
+        with timings.record("run_game"):
+            with timings.phase("storage_load"):
+                await psr.use_storage(storage)
+            start_game(game)
+
+    psr.run_async(start())
+
+
+def start_game(game: itf.Game) -> None:
     # saves
-    match get_saves():
-        case None:
-            saves = GameSaves()
-            psr.local_storage["saves"] = saves
-        case GameSaves() as saves:
-            saves.render()
-    saves.init()
+    with timings.phase("saves"):
+        saves = get_saves()
+        saves.render()
+        saves.init()
+    psr.delegate("saves-table", "click", "data-troubadour-save", run_save_action)
+
+    # story interface
+    psr.delegate(
+        "story-interface", "click", "data-troubadour-click", run_interface_action
+    )
+    psr.delegate(
+        "story-interface", "submit", "data-troubadour-submit", run_interface_action
+    )
 
     psr.onclick("load-button", lambda _: psr.activate_modal("load-modal"))
     psr.onclick("load-modal-cancel", lambda _: psr.deactivate_modal("load-modal"))
@@ -346,10 +847,14 @@ def run_game(game: itf.Game) -> None:
     psr.onclick("resume-modal-restart", restart)
     psr.onclick("resume-modal-load", load_cache_data)
 
+    # story pages that are no longer in the DOM
+    psr.on_scroll_top("story", story_view.show_earlier_page)
+
     # restart button
     def restart2(_: Any, new_game: itf.Game = deepcopy(game)) -> None:
-        psr.clear("story")
-        run_page(deepcopy(new_game), "start")
+        restarted_game = deepcopy(new_game)
+        story_view.reset(restarted_game.story)
+        run_page(restarted_game, "start")
         psr.deactivate_modal("restart-modal")
 
     psr.onclick("restart-button", lambda _: psr.activate_modal("restart-modal"))
@@ -367,11 +872,15 @@ def run_game(game: itf.Game) -> None:
     )
 
     # tooltips
-    psr.add_tooltip("save-button", "Save current game")
-    psr.add_tooltip("load-button", "Load game and manage saves")
-    psr.add_tooltip("python-button", "Access the python console")
-    psr.add_tooltip("dark-mode-toggle", "Toggle color mode (light/dark)")
-    psr.add_tooltip("restart-button", "Restart the game")
+    psr.add_tooltips(
+        {
+            "save-button": "Save current game",
+            "load-button": "Load game and manage saves",
+            "python-button": "Access the python console",
+            "dark-mode-toggle": "Toggle color mode (light/dark)",
+            "restart-button": "Restart the game",
+        }
+    )
 
     # color mode
     match psr.local_storage(ColorMode)["color-mode"]:
@@ -380,8 +889,13 @@ def run_game(game: itf.Game) -> None:
         case ColorMode.dark:
             enable_dark_mode()
 
+    # the page built by troubadour make --prerender is now interactive
+    psr.remove_class("body", "troubadour-prerendered")
+
     # start game
-    match get_state():
+    with timings.phase("state_read"):
+        state = get_state()
+    match state:
         case None:
             run_page(game, "start")
             psr.add_class("screen-cover", "invisible")  # remove screen cover
@@ -421,28 +935,29 @@ def close_resume_modal(_: Any) -> None:
 
 
 def load_cache_data(_: Any) -> None:
-    state = get_state()
-    assert isinstance(state, GameState)
-
-    psr.clear("story")
-    old_history = state.game.story.history.copy()
-    state.game.story.history = []
-    for cmd in reversed(old_history):
-        match cmd:
-            case itf.DisplayCmd(text):
-                state.game.story.display(text)
-            case itf.NewPageCmd():
-                state.game.story.newpage()
-            case itf.ImageCmd(url, alt):
-                state.game.story.image(url, alt)
-            case _:
-                raise NotImplementedError()
-
-    render_info(state.game.info)
-    render_porthole(state.game.porthole)
-
-    psr.clear("story-interface")
-    render_interface(state.game, state.interface)
-
-    close_resume_modal(None)
-    psr.add_class("screen-cover", "invisible")  # remove screen cover
+    global page_turns
+    page_turns += 1
+    with timings.record("load_cache_data"):
+        with timings.phase("state_read"):
+            state = get_state()
+        assert isinstance(state, GameState)
+        state_journal.attach(state.game)
+
+        with psr.batch():
+            with timings.phase("story"):
+                if not story_view.restore(state.game.story):
+                    story_view.reset(state.game.story)
+
+            with timings.phase("render_info"):
+                render_info(state.game.info)
+            with timings.phase("render_porthole"):
+                render_porthole(state.game.porthole)
+
+            with timings.phase("render_interface"):
+                psr.clear("story-interface")
+                render_interface(state.game, state.interface)
+
+            close_resume_modal(None)
+            psr.add_class("screen-cover", "invisible")  # remove screen cover
+            with timings.phase("flush"):
+                psr.flush()
@@ -6,3 +6,12 @@ def get_id() -> int:
     result = NEXT_ID
     NEXT_ID += 1
     return result
+
+
+def peek_id() -> int:
+    return NEXT_ID
+
+
+def reserve_ids(next_id: int) -> None:
+    global NEXT_ID
+    NEXT_ID = max(NEXT_ID, next_id)
@@ -10,6 +10,7 @@ class DisplayCmd:
     text: RichText
 
 
+@dataclass
 class NewPageCmd:
     pass
 
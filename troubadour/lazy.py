@@ -0,0 +1,20 @@
+import importlib
+from types import ModuleType
+from typing import Any, Optional
+
+
+class LazyModule:
+    # imported on first attribute access, so that slow imports happen on first
+    # use (first markdown render, first storage access) instead of at startup
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.module: Optional[ModuleType] = None
+
+    def __getattr__(self, attr: str) -> Any:
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attr)
+
+
+jsonpickle = LazyModule("jsonpickle")
+mistune = LazyModule("mistune")
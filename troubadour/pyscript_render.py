@@ -1,28 +1,154 @@
-from typing import Any, Callable, Optional, TypeVar, Generic, Type, overload
-
-import jsonpickle as jsp
-from pyodide.code import run_js  # type: ignore
-from pyodide.ffi import create_proxy  # type: ignore
-from pyscript import HTML  # type: ignore
+import asyncio
+from contextlib import contextmanager
+import traceback
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Iterator,
+    Optional,
+    Type,
+    TypeVar,
+    overload,
+)
+
+from pyodide.ffi import JsException, create_proxy, to_js  # type: ignore
 from pyscript import Element  # type: ignore
 from pyscript import js  # type: ignore
-from pyscript import display as psdisplay  # type: ignore
+
+from troubadour.codec import Utf8Assembler
+from troubadour.lazy import jsonpickle as jsp
+from troubadour.storage import (  # noqa: F401
+    LocalStorage,
+    MemoryBackend,
+    StorageBackend,
+    TypedLocalStorage,
+    migrate,
+)
+from troubadour.timing import timings
+
+# DOM operations and tooltips recorded while in a batch, see batch()
+_batch: Optional[list[list[Any]]] = None
+_batch_tooltips: list[list[str]] = []
+
+
+@contextmanager
+def batch() -> Iterator[None]:
+    # record DOM operations and apply them in a single JS call on exit
+    global _batch
+    if _batch is not None:  # nested batch, the outermost one applies operations
+        yield
+        return
+    _batch = []
+    try:
+        yield
+    finally:
+        flush()
+        _batch = None
+
+
+def flush() -> None:
+    if _batch or _batch_tooltips:
+        timings.count("ffi:apply")
+        js.troubadour.apply(to_js(_batch or []), to_js(_batch_tooltips))
+        _batch_tooltips.clear()
+    if _batch:
+        _batch.clear()
+
+
+def _record(op: str, id: str, value: Any = None) -> bool:
+    # FFI calls are counted when timings are enabled, see troubadour.timing
+    if _batch is None:
+        timings.count(f"ffi:{op}")
+        return False
+    timings.count("batched")
+    _batch.append([op, id, value])
+    return True
+
+
+# tasks started by run_async(), referenced until they are done
+_tasks: set[asyncio.Task] = set()
+
+
+def _report(task: asyncio.Task) -> None:
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        traceback.print_exception(task.exception())
+
+
+def run_async(coroutine: Coroutine[Any, Any, None]) -> None:
+    task = asyncio.ensure_future(coroutine)  # runs on the pyodide event loop
+    _tasks.add(task)
+    task.add_done_callback(_report)  # errors would be lost otherwise
+
+
+# Listeners and tooltips belong to an owner element, by default the element
+# itself. They are released when the content of the owner is replaced by
+# set_html() or clear(), or when the owner is removed from the page, so pass
+# the container whose content is regenerated as owner.
+
+
+def listen(
+    id: str, type: str, func: Callable[[Any], Any], owner: Optional[str] = None
+) -> None:
+    value = [type, create_proxy(func), owner or id]
+    if not _record("listen", id, value):
+        js.troubadour.listen(Element(id).element, *value)
+
+
+def when_idle(func: Callable[[], None]) -> None:
+    # called once the browser is idle, at the latest when the page is hidden
+    js.troubadour.whenIdle(create_proxy(func))
+
+
+def onclick(id: str, func: Callable[[Any], None], owner: Optional[str] = None) -> None:
+    listen(id, "click", func, owner)
 
 
-def onclick(id: str, func: Callable[[Any], None]) -> None:
-    Element(id).element.addEventListener("click", create_proxy(func))
+def onload(id: str, func: Callable[[Any], None], owner: Optional[str] = None) -> None:
+    listen(id, "load", func, owner)
 
 
-def onload(id: str, func: Callable[[Any], None]) -> None:
-    Element(id).element.addEventListener("load", create_proxy(func))
+def delegate(
+    id: str,
+    type: str,
+    attribute: str,
+    func: Callable[[str], None],
+    owner: str = "body",
+) -> None:
+    # a single listener on the container for all the elements in it carrying
+    # the attribute, func is called with the attribute value of the event
+    # target, the listener outlives the content of the container
+    value = [type, attribute, create_proxy(func), owner]
+    if not _record("delegate", id, value):
+        js.troubadour.delegate(Element(id).element, *value)
+
+
+def live_objects() -> dict[str, int]:
+    # listeners and tooltips currently owned, to check that they do not grow
+    flush()
+    return dict(js.troubadour.counts().to_py())
 
 
 def insert_end(id: str, html: str) -> None:
-    Element(id).element.insertAdjacentHTML("beforeend", html)
+    if not _record("insert", id, html):
+        Element(id).element.insertAdjacentHTML("beforeend", html)
+
+
+def insert_start_keep_scroll(id: str, html: str) -> None:
+    # insert at the beginning without moving the content the player is reading
+    if not _record("insert_start", id, html):
+        js.troubadour.insertStartKeepScroll(Element(id).element, html)
+
+
+def remove(id: str) -> None:
+    if not _record("remove", id):
+        js.troubadour.apply(to_js([["remove", id, None]]), to_js([]))
 
 
 def set_html(id: str, html: str) -> None:
-    Element(id).element.innerHTML = html
+    if not _record("html", id, html):
+        js.troubadour.apply(to_js([["html", id, html]]), to_js([]))
 
 
 def clear(id: str) -> None:
@@ -30,38 +156,50 @@ def clear(id: str) -> None:
 
 
 def click(id: str) -> None:
+    flush()
+    timings.count("ffi:click")
     Element(id).element.click()
 
 
 def set_src(id: str, value: str) -> None:
-    Element(id).element.src = value
+    if not _record("src", id, value):
+        Element(id).element.src = value
 
 
 def set_alt(id: str, value: str) -> None:
-    Element(id).element.alt = value
+    if not _record("alt", id, value):
+        Element(id).element.alt = value
 
 
 def get_value(id: str) -> str:
+    flush()
+    timings.count("ffi:value")
     return Element(id).element.value
 
 
-def add_tooltip(id: str, text: str) -> None:
-    run_js(
-        f"""tippy("#{id}",
-                {{
-                    content:`{text}`,
-                    allowHTML:true,
-                }}
-            );"""
-    )
+def add_tooltip(id: str, text: str, owner: Optional[str] = None) -> None:
+    add_tooltips({id: text}, owner)
+
+
+def add_tooltips(tooltips: dict[str, str], owner: Optional[str] = None) -> None:
+    if not tooltips:
+        return
+    entries = [[id, text, owner or id] for id, text in tooltips.items()]
+    if _batch is not None:
+        _batch_tooltips.extend(entries)
+    else:
+        timings.count("ffi:tooltips")
+        js.troubadour.addTooltips(to_js(entries))
 
 
 def add_class(id: str, cls: str) -> None:
-    Element(id).add_class(cls)
+    if not _record("add_class", id, cls):
+        Element(id).add_class(cls)
 
 
 def remove_class(id: str, cls: str) -> None:
-    Element(id).remove_class(cls)
+    if not _record("remove_class", id, cls):
+        Element(id).remove_class(cls)
 
 
 def activate_modal(id: str) -> None:
@@ -73,69 +211,126 @@ def deactivate_modal(id: str) -> None:
 
 
 def disable(id: str) -> None:
-    Element(id).element.disabled = "disabled"
+    if not _record("disabled", id, "disabled"):
+        Element(id).element.disabled = "disabled"
 
 
 def enable(id: str) -> None:
-    Element(id).element.disabled = None
+    if not _record("disabled", id, None):
+        Element(id).element.disabled = None
 
 
 def set_display(id: str, display: str) -> None:
-    Element(id).element.style.display = display
+    if not _record("display", id, display):
+        Element(id).element.style.display = display
 
 
 def scroll_to_bottom(id: str) -> None:
-    tgt = Element(id).element
-    tgt.scrollTop = tgt.scrollHeight
+    if not _record("scroll", id):
+        tgt = Element(id).element
+        tgt.scrollTop = tgt.scrollHeight
+
+
+def on_scroll_top(id: str, func: Callable[[Any], None]) -> None:
+    # the scroll event is filtered in JS so python is only called at the top
+    flush()
+    js.troubadour.onScrollTop(Element(id).element, create_proxy(func))
 
 
 T = TypeVar("T")
 
 
-class LocalStorage:
-    def __getitem__(self, key: str) -> Optional[str]:
+class WebStorageBackend:
+    # synchronous window.localStorage, limited to a few megabytes
+    def get(self, key: str) -> Optional[str]:
+        timings.count("ffi:storage")
         return js.localStorage.getItem(key)
 
-    def __setitem__(self, key: str, value: Any) -> None:
-        js.localStorage.setItem(key, jsp.encode(value))
+    def set(self, key: str, value: str) -> None:
+        timings.count("ffi:storage")
+        js.localStorage.setItem(key, value)
+
+    def delete(self, key: str) -> None:
+        timings.count("ffi:storage")
+        js.localStorage.removeItem(key)
+
+    def keys(self) -> list[str]:
+        return [js.localStorage.key(i) for i in range(js.localStorage.length)]
+
+    async def load(self) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass
+
+
+class IndexedDBBackend:
+    # values are read from memory, writes are queued in JS and applied in a
+    # single IndexedDB transaction after the current event handler returns
+    def __init__(self, name: str = "troubadour") -> None:
+        self.name = name
+        self.values: dict[str, str] = {}
+        self.store: Any = None
+
+    def get(self, key: str) -> Optional[str]:
+        return self.values.get(key)
+
+    def set(self, key: str, value: str) -> None:
+        timings.count("ffi:storage")
+        self.values[key] = value
+        self.store.write(key, value)
+
+    def delete(self, key: str) -> None:
+        timings.count("ffi:storage")
+        self.values.pop(key, None)
+        self.store.delete(key)
+
+    def keys(self) -> list[str]:
+        return list(self.values)
+
+    async def load(self) -> None:
+        self.store = await js.troubadour.openStore(self.name)
+        self.values = dict(self.store.entries.to_py())
+        if not self.values:  # first load, data may still be in localStorage
+            await migrate(WebStorageBackend(), self)
+
+    async def flush(self) -> None:
+        await self.store.flush()
 
-    def __call__(self, cls: Type[T]) -> "TypedLocalStorage[T]":
-        return TypedLocalStorage(cls)
 
+local_storage = LocalStorage(WebStorageBackend())
 
-class TypedLocalStorage(Generic[T]):
-    def __init__(self, cls: Type[T]) -> None:
-        self.cls = cls
 
-    def __getitem__(self, key: str) -> Optional[T]:
-        result = js.localStorage.getItem(key)
-        if result is not None:
-            decoded_result = jsp.decode(result)
-            assert isinstance(decoded_result, self.cls)
-            return decoded_result
-        else:
-            return None
+async def use_storage(backend: Optional[StorageBackend] = None) -> None:
+    if backend is not None:
+        await local_storage.use(backend)
+        return
+    try:
+        await local_storage.use(IndexedDBBackend())
+    except JsException:  # IndexedDB is not available in some private windows
+        await local_storage.use(WebStorageBackend())
 
 
-local_storage = LocalStorage()
+def download(content: str | bytes, filename: str) -> None:
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    flush()
+    js.troubadour.download(to_js(content), filename, "application/json")
 
 
-def file_download_button(id: str, content: str, filename: str) -> None:
-    run_js(
-        f"""
-const blob = new Blob(
-    [`{content.encode("unicode_escape").decode("utf-8")}`], {{type: 'text/json'}});
-const button = document.getElementById("{id}");
-button.href = URL.createObjectURL(blob);
-button.download = "{filename}";
-        """
-    )
-    # FIXME revoke url
+def on_download(id: str, func: Callable[[], tuple[str | bytes, str]]) -> None:
+    # the content and file name are only built when the element is clicked
+    listen(id, "click", lambda _: download(*func()))
 
 
-def display_story(text: str) -> None:
-    psdisplay(HTML(text), target="story")
-    scroll_to_bottom("story")
+async def read_file(file: Any, chunk_size: int = 1 << 20) -> str:
+    # files are read as array buffers one chunk at a time, so only one chunk
+    # is held in both JS and python memory besides the decoded text
+    text = Utf8Assembler()
+    for start in range(0, file.size, chunk_size):
+        chunk = await file.slice(start, start + chunk_size).arrayBuffer()
+        text.feed(chunk.to_bytes())
+    return text.result()
 
 
 @overload
@@ -156,7 +351,7 @@ def on_file_upload(
     async def event_handler(event: Any, cb: Callable = callback) -> None:
         file_list = event.target.files.to_py()
         for f in file_list:
-            raw = await f.text()
+            raw = await read_file(f)
             if cls is None:
                 cb(raw)
             else:
@@ -165,4 +360,4 @@ def on_file_upload(
                 cb(decoded)
         Element(id).element.value = ""
 
-    Element(id).element.addEventListener("change", create_proxy(event_handler))
+    listen(id, "change", event_handler)
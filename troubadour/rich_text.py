@@ -1,66 +1,360 @@
-from copy import deepcopy
+import re
+from collections import OrderedDict
 from dataclasses import dataclass, field
-from typing import Optional, Any
-
-import mistune
+from functools import lru_cache
+from html import escape
+from string import Formatter
+from typing import Callable, Optional, Any, Sequence
 
 from troubadour.id import get_id
+from troubadour.lazy import mistune
+
+TOOLTIP_ID = re.compile(r"troubadour_tooltip_\d+")
+
+RenderResult = tuple[str, dict[str, str]]
+
+MARKDOWN_PUNCTUATION = re.compile(r"([!-/:-@\[-`{-~])")
+
+
+def escape_html(text: str) -> str:
+    # as mistune escapes text, so that arguments of compiled templates render
+    # the same whether the template is compiled or not
+    return escape(text, quote=False).replace('"', "&quot;")
+
+
+def escape_markdown(text: str) -> str:
+    # backslash escapes, rendered by mistune as the (html escaped) characters
+    return MARKDOWN_PUNCTUATION.sub(r"\\\1", text)
+
+
+def escape_literals(text: str, escape_text: Callable[[str], str]) -> str:
+    # escapes the literal parts of a format string, not its fields
+    result = ""
+    for literal, name, spec, conversion in Formatter().parse(text):
+        result += escape_text(literal).replace("{", "{{").replace("}", "}}")
+        if name is not None:
+            conversion = f"!{conversion}" if conversion else ""
+            spec = f":{spec}" if spec else ""
+            result += f"{{{name}{conversion}{spec}}}"
+    return result
 
 
 @dataclass
+class RenderCache:
+    maxsize: int = 256
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: OrderedDict[Any, RenderResult] = field(default_factory=OrderedDict)
+
+    def get(self, key: Any) -> Optional[RenderResult]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+
+        # tooltip ids must stay unique in the page, so cached ids are only
+        # placeholders that get replaced by fresh ones on every hit
+        html, tooltips = entry
+        new_ids = {old_id: f"troubadour_tooltip_{get_id()}" for old_id in tooltips}
+
+        def remap(text: str) -> str:
+            return TOOLTIP_ID.sub(lambda m: new_ids.get(m[0], m[0]), text)
+
+        return remap(html), {new_ids[id]: remap(tt) for id, tt in tooltips.items()}
+
+    def put(self, key: Any, value: RenderResult) -> None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict[str, int]:
+        return dict(
+            size=len(self.entries),
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+
+render_cache = RenderCache()
+
+# placeholder put in the markdown source of compiled templates, it is left
+# untouched by mistune wherever it ends up in the html
+SLOT = re.compile(r"troubadourslot(\d+)x")
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    segments: tuple[str, ...]
+    slots: tuple[int | str, ...]
+
+
+@lru_cache(maxsize=256)
+def compile_template(text: str) -> Optional[CompiledTemplate]:
+    source = ""
+    fields: list[int | str] = []
+    auto_index = 0
+    for literal, name, spec, conversion in Formatter().parse(text):
+        source += literal
+        if name is None:
+            continue
+        if spec or conversion or "." in name or "[" in name:
+            return None  # not supported by templates, use regular rendering
+        if name == "":
+            fields.append(auto_index)
+            auto_index += 1
+        elif name.isdigit():
+            fields.append(int(name))
+        else:
+            fields.append(name)
+        source += f"troubadourslot{len(fields) - 1}x"
+    if SLOT.search(text):
+        return None
+
+    parts = SLOT.split(str(mistune.html(source)))
+    positions = [int(position) for position in parts[1::2]]
+    if sorted(positions) != list(range(len(fields))):
+        return None  # markdown swallowed or duplicated a placeholder
+    html = ""
+    for segment in parts[:-1:2]:
+        html += segment
+        if html.rfind("<") > html.rfind(">"):
+            return None  # placeholder inside a tag, e.g. a link target
+    return CompiledTemplate(
+        tuple(parts[::2]), tuple(fields[position] for position in positions)
+    )
+
+
 class RichText:
+    # RichText is immutable: builders return new nodes that share the unchanged
+    # parts of the tree instead of copying it
+    __slots__ = (
+        "_text",
+        "_classes",
+        "_tooltip",
+        "_args",
+        "_kwargs",
+        "_compiled",
+        "_hash",
+    )
+
     _text: str
-    _classes: list[str] = field(default_factory=list)
-    _tooltip: Optional["RichText"] = None
-    _args: list["RichText"] = field(default_factory=list)
-    _kwargs: dict[str, "RichText"] = field(default_factory=dict)
+    _classes: tuple[str, ...]
+    _tooltip: Optional["RichText"]
+    _args: tuple["RichText", ...]
+    _kwargs: dict[str, "RichText"]
+    _compiled: bool
+    _hash: int
+
+    def __init__(
+        self,
+        _text: str,
+        _classes: Sequence[str] = (),
+        _tooltip: Optional["RichText"] = None,
+        _args: Sequence["RichText"] = (),
+        _kwargs: Optional[dict[str, "RichText"]] = None,
+        _compiled: bool = False,
+    ) -> None:
+        self.__setstate__(
+            dict(
+                _text=_text,
+                _classes=_classes,
+                _tooltip=_tooltip,
+                _args=_args,
+                _kwargs=_kwargs,
+                _compiled=_compiled,
+            )
+        )
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        # fields can only be set once, which is what jsonpickle does when
+        # decoding data saved before RichText had __getstate__
+        if hasattr(self, name):
+            raise AttributeError(f"RichText is immutable, cannot set {name}")
+        if name in ("_classes", "_args"):
+            value = tuple(value)
+        object.__setattr__(self, name, value)
+
+    def __getattr__(self, name: str) -> Any:
+        # only reached for fields missing from data saved by older versions
+        if name == "_compiled":
+            return False
+        raise AttributeError(name)
+
+    def __getstate__(self) -> dict[str, Any]:
+        return dict(
+            _text=self._text,
+            _classes=list(self._classes),
+            _tooltip=self._tooltip,
+            _args=list(self._args),
+            _kwargs=self._kwargs,
+            _compiled=self._compiled,
+        )
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        object.__setattr__(self, "_text", state["_text"])
+        object.__setattr__(self, "_classes", tuple(state.get("_classes", ())))
+        object.__setattr__(self, "_tooltip", state.get("_tooltip"))
+        object.__setattr__(self, "_args", tuple(state.get("_args", ())))
+        object.__setattr__(self, "_kwargs", dict(state.get("_kwargs") or {}))
+        object.__setattr__(self, "_compiled", state.get("_compiled", False))
+
+    def __copy__(self) -> "RichText":
+        return self
+
+    def __deepcopy__(self, memo: dict[int, Any]) -> "RichText":
+        return self
+
+    def _fields(self) -> tuple:
+        return (
+            self._text,
+            self._classes,
+            self._tooltip,
+            self._args,
+            tuple(sorted(self._kwargs.items())),
+            self._compiled,
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, RichText):
+            return NotImplemented
+        return self is other or self._fields() == other._fields()
+
+    def __hash__(self) -> int:
+        try:
+            return self._hash
+        except AttributeError:
+            object.__setattr__(self, "_hash", hash(self._fields()))
+            return self._hash
+
+    def __repr__(self) -> str:
+        return (
+            f"RichText(_text={self._text!r}, _classes={list(self._classes)!r}, "
+            f"_tooltip={self._tooltip!r}, _args={list(self._args)!r}, "
+            f"_kwargs={self._kwargs!r}, _compiled={self._compiled!r})"
+        )
+
+    def render(self, markdown: bool = True) -> RenderResult:
+        if render_cache.maxsize <= 0:
+            return self._render(markdown)
+        key = (self, markdown)
+        result = render_cache.get(key)
+        if result is None:
+            result = self._render(markdown)
+            render_cache.put(key, (result[0], dict(result[1])))
+        return result
+
+    def _render(
+        self, markdown: bool, escape_text: Optional[Callable[[str], str]] = None
+    ) -> RenderResult:
+        if markdown and self._compiled and self._tooltip is None and not self._classes:
+            template = compile_template(self._text)
+            if template is not None:
+                return self._render_template(template)
+        escape_args = escape_text
+        if markdown and self._compiled:  # arguments are text, as in templates
+            escape_args = escape_markdown
 
-    def render(self, markdown: bool = True) -> tuple[str, dict[str, str]]:
         tooltips: dict[str, str] = {}
         rendered_args = []
         rendered_kwargs = {}
         for arg in self._args:
-            rendered_arg, rec_tooltips = arg.render(False)
+            rendered_arg, rec_tooltips = arg._render(False, escape_args)
             rendered_args.append(rendered_arg)
             tooltips |= rec_tooltips
         for kw, arg in self._kwargs.items():
-            rendered_arg, rec_tooltips = arg.render(False)
+            rendered_arg, rec_tooltips = arg._render(False, escape_args)
             rendered_kwargs[kw] = rendered_arg
             tooltips |= rec_tooltips
-        result = self._text.format(*rendered_args, **rendered_kwargs)
+        text = self._text
+        if escape_text is not None:
+            text = escape_literals(text, escape_text)
+        result = text.format(*rendered_args, **rendered_kwargs)
         html_params = ""
         classes = self._classes
         if self._tooltip is not None:
-            classes.append("tooltip")
+            classes += ("tooltip",)
             id = get_id()
             html_params += f' id="troubadour_tooltip_{id}"'
-            tooltips[f"troubadour_tooltip_{id}"], rec_tooltips = self._tooltip.render()
+            tooltip_html, rec_tooltips = self._tooltip._render(True)
+            tooltips[f"troubadour_tooltip_{id}"] = tooltip_html
             tooltips |= rec_tooltips
         if classes:
-            html_params += f' class="{" ".join(self._classes)}"'
+            html_params += f' class="{" ".join(classes)}"'
         if html_params != "":
             result = f"<span{html_params}>{result}</span>"
         if markdown:
-            result = mistune.html(result)
+            result = str(mistune.html(result))
         return result, tooltips
 
+    def _render_template(self, template: CompiledTemplate) -> RenderResult:
+        # arguments are spliced in the pre-rendered html as escaped text, so
+        # they are not interpreted as markdown
+        tooltips: dict[str, str] = {}
+        values: dict[int | str, str] = {}
+        for index, arg in enumerate(self._args):
+            values[index], rec_tooltips = arg._render(False, escape_html)
+            tooltips |= rec_tooltips
+        for kw, arg in self._kwargs.items():
+            values[kw], rec_tooltips = arg._render(False, escape_html)
+            tooltips |= rec_tooltips
+        if any(slot not in values for slot in template.slots):
+            self._text.format(*self._args, **self._kwargs)  # raises a format error
+
+        result = template.segments[0]
+        for slot, segment in zip(template.slots, template.segments[1:]):
+            result += values[slot] + segment
+        return result, tooltips
+
+    def compile(self) -> "RichText":
+        return RichText(
+            self._text,
+            self._classes,
+            self._tooltip,
+            self._args,
+            self._kwargs,
+            True,
+        )
+
     def classes(self, *classes: str) -> "RichText":
-        result = deepcopy(self)
-        result._classes += classes
-        return result
+        return RichText(
+            self._text,
+            self._classes + classes,
+            self._tooltip,
+            self._args,
+            self._kwargs,
+            self._compiled,
+        )
 
     def tooltip(self, tooltip: "str | RichText") -> "RichText":
-        result = deepcopy(self)
-        result._tooltip = make_rich_text(tooltip)
-        return result
+        return RichText(
+            self._text,
+            self._classes,
+            make_rich_text(tooltip),
+            self._args,
+            self._kwargs,
+            self._compiled,
+        )
 
     def format(self, *args: Any, **kwargs: Any) -> "RichText":
-        result = deepcopy(self)
-        for arg in args:
-            result._args.append(make_rich_text(arg))
-        for key, arg in kwargs.items():
-            result._kwargs[key] = make_rich_text(arg)
-        return result
+        return RichText(
+            self._text,
+            self._classes,
+            self._tooltip,
+            self._args + tuple(make_rich_text(arg) for arg in args),
+            self._kwargs | {key: make_rich_text(arg) for key, arg in kwargs.items()},
+            self._compiled,
+        )
 
 
 def make_rich_text(input: Any) -> RichText:
@@ -0,0 +1,122 @@
+import re
+from typing import Any, Generic, Optional, Protocol, Type, TypeVar
+
+from troubadour.codec import Codec, codecs, decode_value, encode_value
+from troubadour.lazy import jsonpickle as jsp
+
+
+class StorageBackend(Protocol):
+    # reads are synchronous, backends that are asynchronous underneath keep the
+    # values in memory after load() and write them back in the background
+    def get(self, key: str) -> Optional[str]:
+        pass
+
+    def set(self, key: str, value: str) -> None:
+        pass
+
+    def delete(self, key: str) -> None:
+        pass
+
+    def keys(self) -> list[str]:
+        pass
+
+    async def load(self) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass
+
+
+class MemoryBackend:
+    def __init__(self, values: Optional[dict[str, str]] = None) -> None:
+        self.values = values if values is not None else {}
+
+    def get(self, key: str) -> Optional[str]:
+        return self.values.get(key)
+
+    def set(self, key: str, value: str) -> None:
+        self.values[key] = value
+
+    def delete(self, key: str) -> None:
+        self.values.pop(key, None)
+
+    def keys(self) -> list[str]:
+        return list(self.values)
+
+    async def load(self) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass
+
+
+# keys written by troubadour, the other keys of the origin belong to other pages
+# and are left where they are
+TROUBADOUR_KEYS = re.compile(
+    r"state|state-journal-(length|\d+)|saves|saves-index|save-\d+"
+    r"|story-cache|story-page-\d+|color-mode"
+)
+
+
+async def migrate(source: StorageBackend, target: StorageBackend) -> None:
+    # values are copied as stored, then removed from source once written
+    keys = [key for key in source.keys() if TROUBADOUR_KEYS.fullmatch(key)]
+    for key in keys:
+        value = source.get(key)
+        if value is not None:
+            target.set(key, value)
+    await target.flush()
+    for key in keys:
+        source.delete(key)
+
+
+T = TypeVar("T")
+
+
+class LocalStorage:
+    def __init__(
+        self, backend: StorageBackend, codec: Codec = codecs["zlib-utf16"]
+    ) -> None:
+        self.backend = backend
+        self.codec = codec
+
+    async def use(self, backend: StorageBackend) -> None:
+        await backend.load()
+        self.backend = backend
+
+    def __getitem__(self, key: str) -> Optional[str]:
+        result = self.backend.get(key)
+        if result is not None:
+            return decode_value(result)
+        else:
+            return None
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.store(key, value)
+
+    def store(self, key: str, value: Any) -> int:
+        # returns the size of the stored value
+        encoded = encode_value(jsp.encode(value), self.codec)
+        self.backend.set(key, encoded)
+        return len(encoded)
+
+    def __delitem__(self, key: str) -> None:
+        self.backend.delete(key)
+
+    def __call__(self, cls: Type[T]) -> "TypedLocalStorage[T]":
+        return TypedLocalStorage(self, cls)
+
+
+class TypedLocalStorage(Generic[T]):
+    def __init__(self, storage: LocalStorage, cls: Type[T]) -> None:
+        self.storage = storage
+        self.cls = cls
+
+    def __getitem__(self, key: str) -> Optional[T]:
+        result = self.storage.backend.get(key)
+        if result is not None:
+            decoded_result = jsp.decode(decode_value(result))
+            assert isinstance(decoded_result, self.cls)
+            return decoded_result
+        else:
+            return None
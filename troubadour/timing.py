@@ -0,0 +1,90 @@
+import json
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from time import perf_counter
+from typing import Iterator, Optional
+
+
+@dataclass
+class Timing:
+    name: str
+    total: float = 0.0  # milliseconds
+    phases: dict[str, float] = field(default_factory=dict)  # milliseconds
+    counts: dict[str, int] = field(default_factory=dict)  # FFI calls and others
+
+
+@dataclass
+class Timings:
+    # opt-in, from the python terminal: timings.enable(), play a few pages,
+    # then print(timings.summary()) or timings.export() for JSON
+    enabled: bool = False
+    records: deque[Timing] = field(default_factory=lambda: deque(maxlen=100))
+    current: Optional[Timing] = None
+
+    def enable(self, maxlen: int = 100) -> None:
+        self.enabled = True
+        self.records = deque(self.records, maxlen=maxlen)
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def clear(self) -> None:
+        self.records.clear()
+
+    @contextmanager
+    def record(self, name: str) -> Iterator[None]:
+        if not self.enabled or self.current is not None:  # nested records are merged
+            yield
+            return
+        timing = self.current = Timing(name)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            timing.total = (perf_counter() - start) * 1e3
+            self.records.append(timing)
+            self.current = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        timing = self.current
+        if timing is None:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            duration = (perf_counter() - start) * 1e3
+            timing.phases[name] = timing.phases.get(name, 0.0) + duration
+
+    def count(self, name: str) -> None:
+        if self.current is not None:
+            self.current.counts[name] = self.current.counts.get(name, 0) + 1
+
+    def summary(self) -> str:
+        # mean of each phase duration and count, by record name
+        by_name: dict[str, list[Timing]] = {}
+        for timing in self.records:
+            by_name.setdefault(timing.name, []).append(timing)
+        lines = []
+        for name, timings in by_name.items():
+            lines.append(f"{name} ({len(timings)} records)")
+            means: dict[str, float] = {}
+            for timing in timings:
+                for key, value in [("total", timing.total), *timing.phases.items()]:
+                    means[key] = means.get(key, 0.0) + value / len(timings)
+            lines += [f"  {key:<24}{value:10.3f} ms" for key, value in means.items()]
+            counts: dict[str, float] = {}
+            for timing in timings:
+                for key, count in timing.counts.items():
+                    counts[key] = counts.get(key, 0.0) + count / len(timings)
+            lines += [f"  {key:<24}{value:10.1f}" for key, value in counts.items()]
+        return "\n".join(lines)
+
+    def export(self) -> str:
+        return json.dumps([asdict(timing) for timing in self.records], indent=2)
+
+
+timings = Timings()
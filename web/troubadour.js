@@ -0,0 +1,293 @@
+// DOM helpers called from troubadour/pyscript_render.py
+
+window.troubadour = {
+    // tooltip html by element id, read by tippy when creating tooltips
+    tooltips: {},
+
+    // event listeners and tippy instances by owner element id, released when
+    // the content of the owner is replaced or the owner leaves the page
+    scopes: new Map(),
+
+    scope(owner) {
+        const element = document.getElementById(owner);
+        const scope = this.scopes.get(owner);
+        if (scope !== undefined && scope.element === element) {
+            return scope;
+        }
+        this.releaseScope(owner); // the id now belongs to another element
+        const newScope = { element, listeners: [], tooltips: [] };
+        this.scopes.set(owner, newScope);
+        return newScope;
+    },
+
+    releaseScope(owner) {
+        const scope = this.scopes.get(owner);
+        if (scope === undefined) {
+            return;
+        }
+        this.scopes.delete(owner);
+        for (const instance of scope.tooltips) {
+            delete this.tooltips[instance.reference.id];
+            instance.destroy();
+        }
+        for (const [element, type, listener] of scope.listeners) {
+            element.removeEventListener(type, listener);
+        }
+        // the listener being called may be among them, destroy proxies once
+        // the current event handler has returned
+        if (scope.listeners.length > 0) {
+            setTimeout(() => {
+                for (const [, , , proxy] of scope.listeners) {
+                    proxy.destroy();
+                }
+            }, 0);
+        }
+    },
+
+    // release the scopes of elements that are no longer in the page
+    releaseDetached() {
+        for (const [owner, scope] of this.scopes) {
+            if (scope.element === null || !scope.element.isConnected) {
+                this.releaseScope(owner);
+            }
+        }
+    },
+
+    // number of objects held by the scopes, stable across page turns
+    counts() {
+        const counts = { scopes: this.scopes.size, listeners: 0, tooltips: 0 };
+        for (const scope of this.scopes.values()) {
+            counts.listeners += scope.listeners.length;
+            counts.tooltips += scope.tooltips.length;
+        }
+        return counts;
+    },
+
+    listen(element, type, proxy, owner) {
+        element.addEventListener(type, proxy);
+        this.scope(owner).listeners.push([element, type, proxy, proxy]);
+    },
+
+    // a single listener on the container for all its elements carrying the
+    // attribute, callback is called with the attribute value of the closest one
+    delegate(element, type, attribute, callback, owner) {
+        const listener = (event) => {
+            const target = event.target.closest(`[${attribute}]`);
+            if (target === null || !element.contains(target)) {
+                return;
+            }
+            if (type === "submit") {
+                event.preventDefault();
+            }
+            callback(target.getAttribute(attribute));
+        };
+        element.addEventListener(type, listener);
+        this.scope(owner).listeners.push([element, type, listener, callback]);
+    },
+
+    // register a list of [element id, html, owner id] and create all tooltips
+    // at once
+    addTooltips(entries) {
+        const elements = [];
+        const owners = [];
+        for (const [id, html, owner] of entries) {
+            this.tooltips[id] = html;
+            const element = document.getElementById(id);
+            if (element !== null && element._tippy === undefined) {
+                elements.push(element);
+                owners.push(owner);
+            }
+        }
+        const instances = tippy(elements, {
+            content: (reference) => this.tooltips[reference.id],
+            allowHTML: true,
+        });
+        instances.forEach((instance, i) => {
+            this.scope(owners[i]).tooltips.push(instance);
+        });
+    },
+
+    // call callback once the browser is idle, or when the page is hidden
+    // before that
+    whenIdle(callback, timeout = 1000) {
+        let done = false;
+        const run = () => {
+            if (done) {
+                return;
+            }
+            done = true;
+            window.removeEventListener("pagehide", run);
+            try {
+                callback();
+            } finally {
+                callback.destroy();
+            }
+        };
+        window.addEventListener("pagehide", run);
+        if ("requestIdleCallback" in window) {
+            requestIdleCallback(run, { timeout });
+        } else {
+            setTimeout(run, 0);
+        }
+    },
+
+    insertStartKeepScroll(element, html) {
+        const height = element.scrollHeight;
+        element.insertAdjacentHTML("afterbegin", html);
+        element.scrollTop += element.scrollHeight - height;
+    },
+
+    // call callback when the element is scrolled to its top, the listener is
+    // not scoped and lives as long as the element
+    onScrollTop(element, callback) {
+        element.addEventListener("scroll", (event) => {
+            if (element.scrollTop === 0) {
+                callback(event);
+            }
+        });
+    },
+
+    // open an IndexedDB key-value store and read all its entries, writes are
+    // queued and applied in a single transaction once python returns
+    async openStore(name) {
+        const result = (request) =>
+            new Promise((resolve, reject) => {
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => reject(request.error);
+            });
+        const open = indexedDB.open(name, 1);
+        open.onupgradeneeded = () => open.result.createObjectStore("values");
+        const db = await result(open);
+        const values = db.transaction("values").objectStore("values");
+        const [keys, entries] = await Promise.all([
+            result(values.getAllKeys()),
+            result(values.getAll()),
+        ]);
+
+        const pending = new Map(); // value by key, undefined for deletions
+        let written = Promise.resolve();
+        const flush = () => {
+            if (pending.size === 0) {
+                return written;
+            }
+            const transaction = db.transaction("values", "readwrite");
+            const store = transaction.objectStore("values");
+            for (const [key, value] of pending) {
+                if (value === undefined) {
+                    store.delete(key);
+                } else {
+                    store.put(value, key);
+                }
+            }
+            pending.clear();
+            written = new Promise((resolve, reject) => {
+                transaction.oncomplete = () => resolve();
+                transaction.onerror = () => reject(transaction.error);
+            });
+            return written;
+        };
+        // timeouts do not run once the page is hidden, writes made after this
+        // listener (by whenIdle callbacks) are then applied right away
+        let hidden = false;
+        const queue = (key, value) => {
+            if (pending.size === 0 && !hidden) {
+                setTimeout(flush, 0);
+            }
+            pending.set(key, value);
+            if (hidden) {
+                flush();
+            }
+        };
+        window.addEventListener("pagehide", () => {
+            hidden = true;
+            flush();
+        });
+        window.addEventListener("pageshow", () => {
+            hidden = false;
+        });
+
+        return {
+            entries: keys.map((key, i) => [key, entries[i]]),
+            write: (key, value) => queue(key, value),
+            delete: (key) => queue(key, undefined),
+            flush,
+        };
+    },
+
+    // save content as a file, the object url is revoked once the download
+    // had time to start
+    download(content, filename, type) {
+        const url = URL.createObjectURL(new Blob([content], { type }));
+        const link = document.createElement("a");
+        link.href = url;
+        link.download = filename;
+        link.click();
+        setTimeout(() => URL.revokeObjectURL(url), 10000);
+    },
+
+    // apply a list of [operation, element id, value] recorded by psr.batch(),
+    // then create the tooltips registered during the batch
+    apply(ops, tooltips) {
+        const scrolled = new Set();
+        let detached = false;
+        for (const [op, id, value] of ops) {
+            const element = document.getElementById(id);
+            switch (op) {
+                case "html":
+                    element.innerHTML = value;
+                    this.releaseScope(id);
+                    detached = true;
+                    break;
+                case "insert":
+                    element.insertAdjacentHTML("beforeend", value);
+                    break;
+                case "insert_start":
+                    this.insertStartKeepScroll(element, value);
+                    break;
+                case "remove":
+                    element.remove();
+                    detached = true;
+                    break;
+                case "display":
+                    element.style.display = value;
+                    break;
+                case "src":
+                    element.src = value;
+                    break;
+                case "alt":
+                    element.alt = value;
+                    break;
+                case "add_class":
+                    element.classList.add(value);
+                    break;
+                case "remove_class":
+                    element.classList.remove(value);
+                    break;
+                case "disabled":
+                    element.disabled = value;
+                    break;
+                case "listen":
+                    this.listen(element, ...value);
+                    break;
+                case "delegate":
+                    this.delegate(element, ...value);
+                    break;
+                case "scroll":
+                    // only scroll once, after all insertions
+                    scrolled.add(element);
+                    break;
+                default:
+                    console.error(`troubadour: unknown DOM operation ${op}`);
+            }
+        }
+        if (detached) {
+            this.releaseDetached();
+        }
+        if (tooltips.length > 0) {
+            this.addTooltips(tooltips);
+        }
+        for (const element of scrolled) {
+            element.scrollTop = element.scrollHeight;
+        }
+    },
+};
@@ -0,0 +1,33 @@
+// development helpers included by `troubadour watch`
+
+(() => {
+    const script = document.currentScript;
+
+    // reload the page when the build served by troubadour watch changes
+    let version = null;
+    setInterval(async () => {
+        try {
+            const response = await fetch(script.dataset.versionUrl, {
+                cache: "no-store",
+            });
+            const newVersion = await response.text();
+            if (version !== null && newVersion !== version) {
+                location.reload();
+            }
+            version = newVersion;
+        } catch (error) {
+            // server restarting, try again later
+        }
+    }, 1000);
+
+    // resume the stored game instead of asking, the game state is kept in
+    // browser storage across reloads
+    if (script.dataset.autoResume === "true") {
+        const modal = document.getElementById("resume-modal");
+        new MutationObserver(() => {
+            if (modal.classList.contains("is-active")) {
+                document.getElementById("resume-modal-load").click();
+            }
+        }).observe(modal, { attributes: true, attributeFilter: ["class"] });
+    }
+})();